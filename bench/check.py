@@ -0,0 +1,278 @@
+'''
+#
+# Purpose:
+#
+#	Regression checks of mappingload.py against the db.py stand-ins
+#	in bench/standin: each check seeds a SQLite database (seed.py),
+#	runs the loads and compares the outcome with the one it must have.
+#
+# Usage:
+#
+#	check.py [options]
+#
+#	-w = working directory (default: a new temporary directory)
+#
+#	prints one line per check and exits 1 if any check failed
+#
+'''
+
+import io
+import os
+import sys
+import getopt
+import sqlite3
+import tempfile
+import subprocess
+import seed
+import generate
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+loadDir = os.path.dirname(benchDir)
+
+def runLoad(runDir, mode, inputFileNames, load = 'mappingload', settings = {}):
+        '''
+        # requires:
+        #	runDir - run directory (seeded database mgd.db)
+        #	mode - processing mode
+        #	inputFileNames - input files: mapping files (mappingload),
+        #		or one curator file (mappingonlyload)
+        #	load - mappingload or mappingonlyload
+        #	settings - other environment settings of the load
+        #
+        # effects:
+        #	runs the load in runDir
+        #
+        # returns:
+        #	the exit status of the load
+        #
+        '''
+
+        passwordFileName = os.path.join(runDir, 'password')
+        passwordFile = open(passwordFileName, 'w')
+        passwordFile.write('bench\n')
+        passwordFile.close()
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([os.path.join(benchDir, 'standin'), loadDir])
+        env['BENCHDB'] = os.path.join(runDir, 'mgd.db')
+        env.update(settings)
+
+        if load == 'mappingload':
+                command = [sys.executable, os.path.join(loadDir, 'mappingload.py'), \
+                        '-Sbench', '-Dbench', '-Ubench', '-P' + passwordFileName, '-M' + mode, '-ETEXT'] + \
+                        ['-I' + fileName for fileName in inputFileNames]
+        else:
+                command = [sys.executable, os.path.join(loadDir, 'mappingonlyload.py')]
+                env['MGD_DBSERVER'] = 'bench'
+                env['MGD_DBNAME'] = 'bench'
+                env['MGD_DBUSER'] = 'bench'
+                env['MGD_DBPASSWORDFILE'] = passwordFileName
+                env['EXPERIMENTTYPE'] = 'TEXT'
+                env['MAPPINGMODE'] = mode
+                env['JNUM'] = 'J:1'
+                env['CREATEDBY'] = 'dbo'
+                env['MAPPINGONLYDATAFILE'] = inputFileNames[0]
+                env['MAPPINGDATAFILE'] = os.path.join(runDir, 'input.txt.mapping')
+                env['MAPPINGONLYDATALOG'] = os.path.join(runDir, 'mappingonlyload.log')
+                env['MAPPINGONLYSQLFILE'] = os.path.join(runDir, 'mappingonlyload.sql')
+
+        log = open(os.path.join(runDir, 'run.log'), 'a')
+        status = subprocess.call(command, cwd = runDir, env = env, stdout = log, stderr = subprocess.STDOUT)
+        log.close()
+
+        return status
+
+def outputFiles(runDir):
+        '''
+        # requires:
+        #	runDir - run directory
+        #
+        # returns:
+        #	the bcp files and the error file of a preview run in runDir,
+        #	as a dictionary of file name / contents (without the dates
+        #	of the error file)
+        #
+        '''
+
+        contents = {}
+        for fileName in ('MLD_Expts.mapping.bcp', 'MLD_Expt_Marker.mapping.bcp', \
+                         'ACC_Accession.mapping.bcp', 'MLD_Notes.mapping.bcp', 'mappingload.error'):
+                fp = open(os.path.join(runDir, fileName), 'r')
+                contents[fileName] = [line for line in fp if str.find(line, 'Date/Time') < 0]
+                fp.close()
+
+        return contents
+
+def records(runDir):
+        '''
+        # requires:
+        #	runDir - run directory
+        #
+        # returns:
+        #	the MLD_Expt_Marker records of the run database, with the
+        #	chromosome of their Experiment, sorted by _Assoc_key
+        #
+        '''
+
+        connection = sqlite3.connect(os.path.join(runDir, 'mgd.db'))
+        results = connection.execute('''select m._Assoc_key, e.chromosome, m._Marker_key,
+                m._Assay_Type_key, m.sequenceNum, m.description
+                from MLD_Expt_Marker m, MLD_Expts e
+                where m._Expt_key = e._Expt_key
+                order by m._Assoc_key''').fetchall()
+        connection.close()
+
+        return results
+
+def writeInput(fileName, lines, change = None):
+        '''
+        # requires:
+        #	fileName - input file name
+        #	lines - number of input lines
+        #	change - None, or (line number, chromosome)
+        #
+        # effects:
+        #	writes a mapping input file (generate.py) over 5 chromosomes;
+        #	the same lines (and keys) each time, except for the chromosome
+        #	of the changed line
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        lineFile = io.StringIO()
+        generate.generate(lineFile, lines, spread = 5, invalid = 0)
+
+        inputFile = open(fileName, 'w')
+        for lineNum, line in enumerate(io.StringIO(lineFile.getvalue())):
+                if change is not None and lineNum == change[0]:
+                        tokens = str.split(line, '|')
+                        tokens[2] = change[1]
+                        line = '|'.join(tokens)
+                inputFile.write(line)
+        inputFile.close()
+
+def checkRerun(workDir, mode, chromosome):
+        '''
+        # requires:
+        #	workDir - working directory
+        #	mode - full or sync
+        #	chromosome - new chromosome of one input line
+        #
+        # effects:
+        #	loads an input file (incremental mode), then reruns it with
+        #	the same keys and one changed chromosome in the mode:
+        #	the rerun must succeed and leave the records a load of the
+        #	changed file into an empty Reference leaves
+        #
+        # returns:
+        #	None if the check passed, else the reason it failed
+        #
+        '''
+
+        runs = {}
+        for name, loads in (('rerun', [('incremental', 'input.txt'), (mode, 'input.rerun.txt')]), \
+                            ('expected', [('incremental', 'input.rerun.txt')])):
+                runDir = os.path.join(workDir, 'rerun.%s.%s.%s' % (mode, chromosome, name))
+                os.makedirs(runDir, exist_ok = True)
+                seed.seed(os.path.join(runDir, 'mgd.db'), 10000, 1)
+                writeInput(os.path.join(runDir, 'input.txt'), 2000)
+                writeInput(os.path.join(runDir, 'input.rerun.txt'), 2000, (1, chromosome))
+
+                for mode, fileName in loads:
+                        status = runLoad(runDir, mode, [os.path.join(runDir, fileName)])
+                        if status != 0:
+                                return '%s load exited with %s (see %s)' % (mode, status, runDir)
+
+                runs[name] = records(runDir)
+
+        if runs['rerun'] != runs['expected']:
+                return 'the rerun left other records than a load of the changed file'
+
+        return None
+
+def checkFusedWorkers(workDir):
+        '''
+        # requires:
+        #	workDir - working directory
+        #
+        # effects:
+        #	previews a curator file whose descriptions hold the mapping
+        #	file delimiter ('|', escaped or not) with mappingonlyload
+        #	and mappingload in one process (MAPPINGFUSED), with one and
+        #	with two validation workers (MAPPINGWORKERS):
+        #	both runs must write the same bcp and error files
+        #
+        # returns:
+        #	None if the check passed, else the reason it failed
+        #
+        '''
+
+        lineFile = io.StringIO()
+        generate.generate(lineFile, 1000, spread = 5, format = 'curator')
+
+        runs = {}
+        for workers in ('1', '2'):
+                runDir = os.path.join(workDir, 'fused.%s' % (workers))
+                os.makedirs(runDir, exist_ok = True)
+                seed.seed(os.path.join(runDir, 'mgd.db'), 10000, 1)
+
+                inputFileName = os.path.join(runDir, 'input.txt')
+                inputFile = open(inputFileName, 'w')
+                for lineNum, line in enumerate(io.StringIO(lineFile.getvalue())):
+                        if lineNum % 100 == 1:
+                                line = str.replace(line, 'synthetic', 'synthetic \\| escaped')
+                        elif lineNum % 100 == 2:
+                                line = str.replace(line, 'synthetic', 'synthetic|bare|pipes')
+                        inputFile.write(line)
+                inputFile.close()
+
+                status = runLoad(runDir, 'preview', [inputFileName], 'mappingonlyload', \
+                        {'MAPPINGFUSED' : 'yes', 'MAPPINGWORKERS' : workers, 'MAPPINGWORKERCHUNK' : '100'})
+                if status != 0:
+                        return 'the run with %s workers exited with %s (see %s)' % (workers, status, runDir)
+
+                runs[workers] = outputFiles(runDir)
+
+        for fileName in runs['1']:
+                if runs['1'][fileName] != runs['2'][fileName]:
+                        return '%s differs between 1 and 2 workers' % (fileName)
+
+        return None
+
+checks = [
+        ('sync rerun, same keys, chromosome moved to a new experiment', checkRerun, ['sync', '7']),
+        ('sync rerun, same keys, chromosome moved to an existing experiment', checkRerun, ['sync', '1']),
+        ('full rerun, same keys, chromosome moved to a new experiment', checkRerun, ['full', '7']),
+        ('fused preview, 1 and 2 workers, \'|\' in the descriptions', checkFusedWorkers, []),
+        ]
+
+if __name__ == '__main__':
+
+        try:
+                optlist, args = getopt.getopt(sys.argv[1:], 'w:')
+        except getopt.GetoptError:
+                sys.stderr.write(__doc__)
+                sys.exit(1)
+
+        workDir = None
+        for opt, value in optlist:
+                if opt == '-w':
+                        workDir = value
+
+        if workDir is None:
+                workDir = tempfile.mkdtemp(prefix = 'mappingload.check.')
+
+        print('working directory: %s' % (workDir))
+
+        failed = 0
+        for name, check, args in checks:
+                reason = check(workDir, *args)
+                if reason is None:
+                        print('ok      %s' % (name))
+                else:
+                        print('FAILED  %s: %s' % (name, reason))
+                        failed = failed + 1
+
+        sys.exit(failed > 0)
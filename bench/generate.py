@@ -0,0 +1,118 @@
+'''
+#
+# Purpose:
+#
+#	Generates a synthetic mapping input file for the benchmark harness
+#	(see run.py)
+#
+# Usage:
+#
+#	generate.py [options] > file
+#
+#	-n = number of mapping lines (default 10000)
+#	-m = number of distinct marker ids to draw from (default 5000)
+#	-c = number of distinct chromosomes to spread the lines over (default 21)
+#	-e = share of invalid lines, 0.0 - 1.0 (default 0.01);
+#	     alternately an unknown marker id and an invalid chromosome
+#	-t = format: mapping (mappingload.py) or curator (mappingonlyload.py)
+#	-j = J: (default J:1)
+#	-u = created by (default dbo)
+#	-N = do not add the trailing note line (mapping format only)
+#	-s = random seed (default 1)
+#	-k = first MLD_Expt_Marker key (mapping format only, default 100000)
+#
+'''
+
+import sys
+import getopt
+import random
+
+# chromosomes and assay loaded by seed.py
+chromosomes = [str(c) for c in range(1, 20)] + ['X', 'Y', 'XY', 'MT']
+assay = 'assembly'
+
+firstMappingKey = 100000
+
+def markerID(i):
+        '''
+        # returns:
+        #	accession id of seeded marker i (see seed.py)
+        '''
+
+        return 'MGI:%d' % (1000000 + i)
+
+def generate(fp, lines = 10000, markers = 5000, spread = 21, invalid = 0.01, \
+             format = 'mapping', jnum = 'J:1', createdBy = 'dbo', note = 1, seed = 1, \
+             firstKey = firstMappingKey):
+        '''
+        # requires:
+        #	fp - output file pointer
+        #	see Usage for the other parameters
+        #
+        # effects:
+        #	writes the synthetic input file
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        r = random.Random(seed)
+        errors = 0
+
+        for i in range(lines):
+                marker = markerID(r.randint(1, markers))
+                chromosome = chromosomes[r.randrange(min(spread, len(chromosomes)))]
+
+                if r.random() < invalid:
+                        errors = errors + 1
+                        if errors % 2:
+                                marker = 'MGI:%d' % (9000000 + i)
+                        else:
+                                chromosome = 'ZZ'
+
+                updateChr = r.choice(['yes', 'no'])
+                band = r.choice(['', '', 'A1', 'B2'])
+                description = 'synthetic mapping line %d' % (i + 1)
+
+                if format == 'curator':
+                        fp.write('\t'.join([marker, chromosome, updateChr, band, assay, description]) + '\n')
+                else:
+                        fp.write('|'.join([str(firstKey + i), marker, chromosome, updateChr, band, \
+                                assay, description, jnum, createdBy]) + '\n')
+
+        if note and format == 'mapping':
+                fp.write('synthetic mapping experiment note\n')
+
+if __name__ == '__main__':
+
+        try:
+                optlist, args = getopt.getopt(sys.argv[1:], 'n:m:c:e:t:j:u:Ns:k:')
+        except getopt.GetoptError:
+                sys.stderr.write(__doc__)
+                sys.exit(1)
+
+        options = {}
+        for opt, value in optlist:
+                if opt == '-n':
+                        options['lines'] = int(value)
+                elif opt == '-m':
+                        options['markers'] = int(value)
+                elif opt == '-c':
+                        options['spread'] = int(value)
+                elif opt == '-e':
+                        options['invalid'] = float(value)
+                elif opt == '-t':
+                        options['format'] = value
+                elif opt == '-j':
+                        options['jnum'] = value
+                elif opt == '-u':
+                        options['createdBy'] = value
+                elif opt == '-N':
+                        options['note'] = 0
+                elif opt == '-s':
+                        options['seed'] = int(value)
+                elif opt == '-k':
+                        options['firstKey'] = int(value)
+
+        generate(sys.stdout, **options)
@@ -0,0 +1,190 @@
+'''
+#
+# Purpose:
+#
+#	Offline benchmark of mappingload.py and mappingonlyload.py.
+#
+#	For each input size, seeds a SQLite database (seed.py), generates a
+#	synthetic input file (generate.py) and runs the load against the
+#	db.py/loadlib.py stand-ins in bench/standin (runner.py).
+#	Reports lines/sec, peak RSS and the time and number of database
+#	queries of each phase, so that scaling regressions show up before
+#	they reach production.
+#
+# Usage:
+#
+#	run.py [options]
+#
+#	-n = comma-separated input sizes, in lines (default 1000,10000,100000)
+#	-m = number of distinct marker ids in the input (default 5000)
+#	-k = number of markers in the database (default 50000)
+#	-c = number of chromosomes the input is spread over (default 21)
+#	-e = share of invalid lines (default 0.01)
+#	-M = processing mode (default preview)
+#	-l = load: mappingload, mappingonlyload or both (default both)
+#	-r = mappingload: number of References; the input is split into one
+#	     file per Reference (J:1, J:2, ...), loaded in one run (default 1)
+#	-w = working directory (default: a new temporary directory)
+#
+#	in full and sync mode, mappingload first loads the same input in
+#	incremental mode, so that the measured run replaces existing
+#	experiments of every Reference
+#
+'''
+
+import os
+import sys
+import json
+import getopt
+import tempfile
+import subprocess
+import seed
+import generate
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+loadDir = os.path.dirname(benchDir)
+
+def runLoad(load, lines, options, workDir):
+        '''
+        # requires:
+        #	load - mappingload or mappingonlyload
+        #	lines - number of input lines
+        #	options - dictionary of run.py options
+        #	workDir - working directory
+        #
+        # effects:
+        #	seeds the database, generates the input file and runs the load
+        #
+        # returns:
+        #	the statistics written by runner.py
+        #
+        '''
+
+        runDir = os.path.join(workDir, '%s.%d' % (load, lines))
+        os.makedirs(runDir, exist_ok = True)
+
+        dbFileName = os.path.join(runDir, 'mgd.db')
+        seed.seed(dbFileName, options['dbMarkers'], options['references'])
+
+        if load == 'mappingload':
+                format = 'mapping'
+                references = options['references']
+        else:
+                format = 'curator'
+                references = 1
+
+        # one input file per Reference; the first one takes the remainder
+        inputFileNames = []
+        firstKey = generate.firstMappingKey
+        for i in range(references):
+                fileLines = lines // references
+                if i == 0:
+                        fileLines = fileLines + lines % references
+                if references > 1:
+                        inputFileName = os.path.join(runDir, 'input.%d.txt' % (i + 1))
+                else:
+                        inputFileName = os.path.join(runDir, 'input.txt')
+                inputFile = open(inputFileName, 'w')
+                generate.generate(inputFile, fileLines, options['markers'], options['spread'], options['invalid'], \
+                        format, jnum = 'J:%d' % (i + 1), seed = i + 1, firstKey = firstKey)
+                inputFile.close()
+                inputFileNames.append(inputFileName)
+                firstKey = firstKey + fileLines
+
+        passwordFileName = os.path.join(runDir, 'password')
+        passwordFile = open(passwordFileName, 'w')
+        passwordFile.write('bench\n')
+        passwordFile.close()
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([os.path.join(benchDir, 'standin'), loadDir])
+        env['BENCHDB'] = dbFileName
+        env['MAPPINGMODE'] = options['mode']
+        env['JNUM'] = 'J:1'
+        env['CREATEDBY'] = 'dbo'
+        env['MAPPINGONLYDATAFILE'] = inputFileName
+        env['MAPPINGDATAFILE'] = os.path.join(runDir, 'input.txt.mapping')
+        env['MAPPINGONLYDATALOG'] = os.path.join(runDir, 'mappingonlyload.log')
+        env['MAPPINGONLYSQLFILE'] = os.path.join(runDir, 'mappingonlyload.sql')
+
+        statsFileName = os.path.join(runDir, 'stats.json')
+        log = open(os.path.join(runDir, 'run.log'), 'w')
+
+        runs = [options['mode']]
+        if load == 'mappingload' and options['mode'] in ('full', 'sync'):
+                runs = ['incremental'] + runs
+
+        for mode in runs:
+                if os.path.exists(statsFileName):
+                        os.remove(statsFileName)
+                command = [sys.executable, os.path.join(benchDir, 'runner.py'), statsFileName, load]
+                if load == 'mappingload':
+                        command = command + ['-Sbench', '-Dbench', '-Ubench', '-P' + passwordFileName, \
+                                '-M' + mode, '-ETEXT'] + ['-I' + fileName for fileName in inputFileNames]
+                subprocess.call(command, cwd = runDir, env = env, stdout = log, stderr = subprocess.STDOUT)
+
+        log.close()
+
+        statsFile = open(statsFileName, 'r')
+        stats = json.load(statsFile)
+        statsFile.close()
+
+        return stats
+
+def report(load, lines, stats):
+        '''
+        # effects:
+        #	prints the statistics of one run
+        '''
+
+        print('%-16s %9d lines  %8.2f sec  %10.0f lines/sec  %8.1f MB peak RSS  status %s' % \
+                (load, lines, stats['seconds'], lines / max(stats['seconds'], 1e-9), \
+                stats['peakRSS'] / 1048576.0, stats['status']))
+
+        for name in stats['phases']:
+                phase = stats['phases'][name]
+                print('    %-18s %8.2f sec  %8d queries  %10d rows' % \
+                        (name, phase['seconds'], phase['queries'], phase['rows']))
+
+if __name__ == '__main__':
+
+        try:
+                optlist, args = getopt.getopt(sys.argv[1:], 'n:m:k:c:e:M:l:w:r:')
+        except getopt.GetoptError:
+                sys.stderr.write(__doc__)
+                sys.exit(1)
+
+        sizes = [1000, 10000, 100000]
+        loads = ['mappingload', 'mappingonlyload']
+        workDir = None
+        options = {'markers' : 5000, 'dbMarkers' : 50000, 'spread' : 21, 'invalid' : 0.01, 'mode' : 'preview', 'references' : 1}
+
+        for opt, value in optlist:
+                if opt == '-n':
+                        sizes = [int(n) for n in str.split(value, ',')]
+                elif opt == '-m':
+                        options['markers'] = int(value)
+                elif opt == '-k':
+                        options['dbMarkers'] = int(value)
+                elif opt == '-c':
+                        options['spread'] = int(value)
+                elif opt == '-e':
+                        options['invalid'] = float(value)
+                elif opt == '-M':
+                        options['mode'] = value
+                elif opt == '-l':
+                        if value != 'both':
+                                loads = [value]
+                elif opt == '-w':
+                        workDir = value
+                elif opt == '-r':
+                        options['references'] = int(value)
+
+        if workDir is None:
+                workDir = tempfile.mkdtemp(prefix = 'mappingload.bench.')
+
+        print('working directory: %s' % (workDir))
+
+        for load in loads:
+                for lines in sizes:
+                        report(load, lines, runLoad(load, lines, options, workDir))
@@ -0,0 +1,97 @@
+'''
+#
+# Purpose:
+#
+#	Runs one load under the db.py stand-in (standin/db.py) and writes
+#	the wall time, query count and rows fetched of each phase, and the
+#	peak RSS of the process, to a JSON file (see run.py)
+#
+# Usage:
+#
+#	runner.py statsFile mappingload [mappingload.py options]
+#	runner.py statsFile mappingonlyload
+#
+# Assumes:
+#
+#	PYTHONPATH lists bench/standin before the mappingload directory
+#
+'''
+
+import sys
+import json
+import time
+import resource
+import importlib
+import traceback
+import db
+
+phases = {
+        'mappingload' : ['init', 'verifyMode', 'loadDictionaries', 'processFile', \
+                         'createAccessionBCP', 'bcpFiles', 'spillFiles'],
+        'mappingonlyload' : ['init', 'processFile', 'processFused', 'updateMarkers'],
+        }
+
+seconds = {}
+
+def wrap(module, name):
+        '''
+        # effects:
+        #	replaces module.name with a version that times the phase
+        #	and attributes its queries to it (db.setPhase)
+        '''
+
+        function = getattr(module, name)
+
+        def phase(*args, **kwargs):
+                previous = db.setPhase(name)
+                start = time.time()
+                try:
+                        return function(*args, **kwargs)
+                finally:
+                        seconds[name] = seconds.get(name, 0) + time.time() - start
+                        db.setPhase(previous)
+
+        setattr(module, name, phase)
+
+if __name__ == '__main__':
+
+        statsFileName = sys.argv[1]
+        load = sys.argv[2]
+        argv = sys.argv[3:]
+
+        start = time.time()
+        module = importlib.import_module(load)
+
+        for name in phases[load]:
+                wrap(module, name)
+
+        status = 0
+        try:
+                if load == 'mappingload':
+                        module.main(argv)
+                else:
+                        module.main()
+                module.exit(0)
+        except SystemExit as e:
+                status = e.code
+        except Exception:
+                traceback.print_exc()
+                status = 1
+
+        stats = {
+                'status' : status,
+                'seconds' : time.time() - start,
+                'peakRSS' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                'phases' : {},
+                }
+
+        for name in list(seconds) + list(db.stats):
+                phase = stats['phases'].setdefault(name, {'seconds' : 0, 'queries' : 0, 'rows' : 0})
+                phase['seconds'] = seconds.get(name, 0)
+                phase.update(db.stats.get(name, {}))
+
+        statsFile = open(statsFileName, 'w')
+        json.dump(stats, statsFile, indent = 2)
+        statsFile.close()
+
+        sys.exit(status)
@@ -0,0 +1,100 @@
+'''
+#
+# Purpose:
+#
+#	Creates the SQLite database used by the db.py stand-in
+#	(standin/db.py) of the benchmark harness (see run.py), seeded with
+#	MRK_Marker, MRK_Acc_View, MRK_Chromosome, MLD_Assay_Types and the
+#	other tables the loads read or write
+#
+# Usage:
+#
+#	seed.py database [number of markers [number of References]]
+#
+'''
+
+import os
+import sys
+import sqlite3
+import generate
+
+def seed(fileName, markers = 50000, references = 1):
+        '''
+        # requires:
+        #	fileName - SQLite database file (replaced)
+        #	markers - number of mouse markers to create
+        #	references - number of References (J:1, J:2, ...)
+        #
+        # effects:
+        #	creates and seeds the database
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        if os.path.exists(fileName):
+                os.remove(fileName)
+
+        db = sqlite3.connect(fileName)
+        db.executescript('''
+                create table sequences (name text primary key, value int);
+                create table MRK_Marker (_Marker_key int primary key, _Organism_key int, symbol text,
+                        chromosome text, cytogeneticOffset text, modification_date text);
+                create table ACC_Accession (_Accession_key int primary key, accID text, prefixPart text,
+                        numericPart int, _LogicalDB_key int, _Object_key int, _MGIType_key int,
+                        private int, preferred int, _CreatedBy_key int, _ModifiedBy_key int,
+                        creation_date text, modification_date text);
+                create index idx_acc_accid on ACC_Accession (accID);
+                create index idx_acc_object on ACC_Accession (_Object_key, _MGIType_key);
+                create view MRK_Acc_View as select * from ACC_Accession where _MGIType_key = 2;
+                create table ACC_AccessionMax (prefixPart text, maxNumericPart int);
+                create table MRK_Chromosome (_Organism_key int, chromosome text, sequenceNum int,
+                        modification_date text);
+                create table MLD_Assay_Types (_Assay_Type_key int, description text, modification_date text);
+                create table MLD_Expts (_Expt_key int primary key, _Refs_key int, exptType text, tag int,
+                        chromosome text, creation_date text, modification_date text);
+                create index idx_expts_refs on MLD_Expts (_Refs_key);
+                create table MLD_Expt_Marker (_Assoc_key int primary key,
+                        _Expt_key int references MLD_Expts on delete cascade, _Marker_key int,
+                        _Allele_key int, _Assay_Type_key int, sequenceNum int, description text,
+                        matrixData int, creation_date text, modification_date text);
+                create index idx_exptmarker_expt on MLD_Expt_Marker (_Expt_key);
+                create table MLD_Notes (_Refs_key int, note text, creation_date text, modification_date text);
+                create table BIB_Acc_View (accID text, _Object_key int);
+                create table MGI_User (login text, _User_key int);
+
+                insert into sequences values ('mld_expts_seq', 1000);
+                insert into sequences values ('mld_expt_marker_seq', %d);
+                insert into sequences values ('acc_accession_seq', 10000000);
+                insert into ACC_AccessionMax values ('MGI:', 8000000);
+                insert into MGI_User values ('dbo', 1000);
+                insert into MLD_Assay_Types values (1, '%s', '2020-01-01');
+                insert into MLD_Assay_Types values (2, 'FISH', '2020-01-01');
+                ''' % (generate.firstMappingKey, generate.assay))
+
+        db.executemany('insert into BIB_Acc_View values (?, ?)', \
+                [('J:%d' % (i), i) for i in range(1, references + 1)])
+        db.executemany('insert into MRK_Chromosome values (1, ?, ?, \'2020-01-01\')', \
+                [(c, i) for i, c in enumerate(generate.chromosomes + ['UN'])])
+        db.executemany('insert into MRK_Marker values (?, 1, ?, ?, null, \'2020-01-01\')', \
+                [(i, 'Sym%d' % (i), generate.chromosomes[i % len(generate.chromosomes)]) \
+                for i in range(1, markers + 1)])
+        db.executemany('''insert into ACC_Accession values (?, ?, 'MGI:', ?, 1, ?, 2, 0, 1, 1000, 1000,
+                '2020-01-01', '2020-01-01')''', \
+                [(i, generate.markerID(i), int(generate.markerID(i)[4:]), i) for i in range(1, markers + 1)])
+        db.commit()
+        db.close()
+
+if __name__ == '__main__':
+
+        if len(sys.argv) < 2:
+                sys.stderr.write(__doc__)
+                sys.exit(1)
+
+        if len(sys.argv) > 3:
+                seed(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
+        elif len(sys.argv) > 2:
+                seed(sys.argv[1], int(sys.argv[2]))
+        else:
+                seed(sys.argv[1])
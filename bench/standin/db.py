@@ -0,0 +1,222 @@
+'''
+#
+# Purpose:
+#
+#	SQLite stand-in for the MGI db.py module, so that mappingload.py and
+#	mappingonlyload.py can be benchmarked without a MGD PostgreSQL
+#	database (see bench/run.py)
+#
+#	Only the part of db.py used by the loads is provided.
+#	The PostgreSQL constructs used by the loads are emulated:
+#		nextval()/setval(), now(), generate_series(),
+#		<sequence>.last_value, is_called,
+#		pg_index (secondary indexes of a table), drop index,
+#		pg_class.reltuples (number of rows of a table),
+#		alter table ... disable/enable trigger, analyze,
+#		select ... into temporary table,
+#		update <table> <alias> ... from,
+#		copy ... from stdin (see psycopg2.py)
+#
+#	The number of queries and rows fetched is kept per phase
+#	(see setPhase, stats)
+#
+# Assumes:
+#
+#	BENCHDB is the SQLite database created by bench/seed.py
+#
+'''
+
+import os
+import re
+import sqlite3
+import threading
+import datetime
+
+# queries/rows by phase: phase / {'queries' : n, 'rows' : n}
+stats = {}
+phase = 'other'
+
+lock = threading.Lock()
+
+server = ''
+database = ''
+user = ''
+password = ''
+
+connection = None
+sharedDbConn = None
+committed = None	# connection that only sees committed rows (see committedKeys)
+
+def now():
+        return datetime.datetime.now().isoformat(' ')
+
+def nextval(name):
+        value = connection.execute('select value from sequences where name = ?', (name,)).fetchone()[0] + 1
+        connection.execute('update sequences set value = ? where name = ?', (value, name))
+        return value
+
+def setval(name, value):
+        connection.execute('update sequences set value = ? where name = ?', (value, name))
+        return value
+
+def connect():
+        global connection, sharedDbConn
+
+        if connection is None:
+                import psycopg2
+                connection = sqlite3.connect(os.environ['BENCHDB'], check_same_thread = False)
+                connection.row_factory = sqlite3.Row
+                # MLD_Expt_Marker rows go with their MLD_Expts row (see seed.py)
+                connection.execute('pragma foreign_keys = on')
+                # lets committedKeys read the committed rows while
+                # this connection has changes that are not committed
+                connection.execute('pragma journal_mode = wal')
+                connection.create_function('now', 0, now)
+                connection.create_function('nextval', 1, nextval)
+                connection.create_function('setval', 2, setval)
+                sharedDbConn = psycopg2.Connection()
+
+        return connection
+
+def setPhase(name):
+        global phase
+
+        previous = phase
+        phase = name
+        return previous
+
+def count(rows):
+        s = stats.setdefault(phase, {'queries' : 0, 'rows' : 0})
+        s['queries'] = s['queries'] + 1
+        s['rows'] = s['rows'] + rows
+
+class Row(dict):
+        '''
+        # result row; column names are case-insensitive, as with db.py
+        '''
+
+        def __init__(self, row):
+                dict.__init__(self, [(str.lower(k), row[k]) for k in row.keys()])
+
+        def __getitem__(self, key):
+                return dict.__getitem__(self, str.lower(key))
+
+def translate(command):
+        '''
+        # rewrites the PostgreSQL-only constructs used by the loads
+        '''
+
+        m = re.match(r'\s*select c.relname, pg_get_indexdef.* t.relname = \'(\w+)\'', command, re.S)
+        if m:
+                return '''select name, sql from sqlite_master where type = 'index' and sql is not null
+                        and lower(tbl_name) = '%s' ''' % (m.group(1))
+
+        m = re.match(r'\s*(drop index|analyze) mgd\.(\w+)\s*$', command)
+        if m:
+                return '%s %s' % (m.group(1), m.group(2))
+
+        m = re.match(r'\s*select c.reltuples\s+from pg_class c, pg_namespace n.* c.relname = \'(\w+)\'', command, re.S)
+        if m:
+                return 'select count(*) as reltuples from %s' % (m.group(1))
+
+        if re.match(r'\s*alter table \S+ (disable|enable) trigger \w+\s*$', command):
+                return 'select 1'
+
+        m = re.match(r'(.*)\s+from generate_series\(1, (\d+)\)\s*$', command, re.S | re.I)
+        if m:
+                return '''with recursive series(value) as
+                        (select 1 union all select value + 1 from series where value < %s)
+                        %s from series''' % (m.group(2), m.group(1))
+
+        m = re.match(r'(.*)\s+from (\w+_seq) where last_value < (\d+)\s*$', command, re.S | re.I)
+        if m:
+                return "%s from sequences where name = '%s' and value < %s" % (m.group(1), m.group(2), m.group(3))
+
+        m = re.match(r'\s*select last_value, is_called from (\w+_seq)\s*$', command)
+        if m:
+                return "select value as last_value, 1 as is_called from sequences where name = '%s'" % (m.group(1))
+
+        m = re.match(r'\s*select (.*?)\s+into temporary table (\w+)\s+(from .*)', command, re.S | re.I)
+        if m:
+                return 'create temp table %s as select %s %s' % (m.group(2), m.group(1), m.group(3))
+
+        m = re.match(r'\s*delete from (\w+) (\w+)\s+using (\w+) (\w+)\s+where (.*)', command, re.S | re.I)
+        if m:
+                return 'delete from %s where exists (select 1 from %s %s where %s)' % \
+                        (m.group(1), m.group(3), m.group(4), m.group(5).replace(m.group(2) + '.', m.group(1) + '.'))
+
+        command = re.sub(r'^\s*update (\w+) (\w+)\s*\n', r'update \1 as \2 ', command)
+
+        return command
+
+def sql(command, parser = 'auto', execute = 1, **kwargs):
+        if not execute:
+                count(0)
+                return []
+
+        with lock:
+                cursor = connect().execute(translate(command))
+                if cursor.description is None:
+                        count(0)
+                        return []
+                results = [Row(r) for r in cursor.fetchall()]
+
+        count(len(results))
+        return results
+
+def committedKeys(table, rows):
+        '''
+        # returns the primary keys of rows that are committed in table.
+        # a separate connection (see psycopg2.py) cannot load them:
+        # PostgreSQL raises a unique violation or, if the db.py connection
+        # has deleted the row but not committed, waits for it (forever,
+        # if the db.py connection then waits for the load)
+        '''
+
+        global committed
+
+        if committed is None:
+                committed = sqlite3.connect(os.environ['BENCHDB'], check_same_thread = False)
+
+        columns = [r[1] for r in committed.execute('pragma table_info(%s)' % (table)) if r[5] == 1]
+        if len(columns) != 1:
+                return []
+
+        column = [r[1] for r in committed.execute('pragma table_info(%s)' % (table))].index(columns[0])
+        keys = [row[column] for row in rows]
+
+        found = []
+        for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                found.extend([r[0] for r in committed.execute('select %s from %s where %s in (%s)' % \
+                        (columns[0], table, columns[0], ','.join('?' * len(chunk))), chunk)])
+        return found
+
+def commit():
+        with lock:
+                connect().commit()
+
+def set_sqlLogin(u, p, s, d):
+        global user, password, server, database
+        user, password, server, database = u, p, s, d
+
+def useOneConnection(onlyOne = 0):
+        pass
+
+def set_sqlLogFunction(function):
+        pass
+
+def sqlLogAll(*args, **kwargs):
+        pass
+
+def set_commandLogFile(fileName):
+        pass
+
+def get_sqlServer():
+        return server
+
+def get_sqlDatabase():
+        return database
+
+def get_sqlUser():
+        return user
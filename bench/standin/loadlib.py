@@ -0,0 +1,28 @@
+'''
+#
+# Purpose:
+#
+#	stand-in for the MGI loadlib.py module (see db.py in this directory)
+#
+'''
+
+import time
+import db
+
+loaddate = time.strftime('%m/%d/%Y')
+
+def verifyReference(referenceID, lineNum, errorFile = None):
+        results = db.sql('''select _Object_key from BIB_Acc_View where accID = '%s' ''' % (referenceID), 'auto')
+        if len(results) > 0:
+                return results[0]['_Object_key']
+        if errorFile is not None:
+                errorFile.write('Invalid Reference (%d): %s\n' % (lineNum, referenceID))
+        return 0
+
+def verifyUser(userID, lineNum, errorFile = None):
+        results = db.sql('''select _User_key from MGI_User where login = '%s' ''' % (userID), 'auto')
+        if len(results) > 0:
+                return results[0]['_User_key']
+        if errorFile is not None:
+                errorFile.write('Invalid User (%d): %s\n' % (lineNum, userID))
+        return 0
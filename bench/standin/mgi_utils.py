@@ -0,0 +1,12 @@
+'''
+#
+# Purpose:
+#
+#	stand-in for the MGI mgi_utils.py module (see db.py in this directory)
+#
+'''
+
+import time
+
+def date(format = '%c'):
+        return time.strftime(format)
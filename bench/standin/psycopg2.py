@@ -0,0 +1,116 @@
+'''
+#
+# Purpose:
+#
+#	stand-in for psycopg2 (see db.py in this directory): every connection
+#	shares the SQLite database of the db.py stand-in; "copy ... from stdin"
+#	is emulated with inserts.
+#	a connection other than the db.py one cannot load a key that is
+#	committed in the table (see db.committedKeys)
+#
+'''
+
+import re
+import db
+
+class Error(Exception):
+        pass
+
+escapes = {'n' : '\n', 'r' : '\r', 't' : '\t', '\\' : '\\'}
+
+def splitRow(line, delimiter, null):
+        '''
+        # splits one row of the copy text format: the delimiter and
+        # backslash escapes are decoded, as by PostgreSQL
+        '''
+
+        values = []
+        value = []
+        raw = []
+        i = 0
+        while i < len(line):
+                c = line[i]
+                if c == '\\' and i + 1 < len(line):
+                        i = i + 1
+                        value.append(escapes.get(line[i], line[i]))
+                        raw.append(c + line[i])
+                elif c == delimiter:
+                        values.append(None if ''.join(raw) == null else ''.join(value))
+                        value = []
+                        raw = []
+                else:
+                        value.append(c)
+                        raw.append(c)
+                i = i + 1
+        values.append(None if ''.join(raw) == null else ''.join(value))
+        return values
+
+class Cursor:
+
+        def __init__(self, separate):
+                self.separate = separate
+                self.rowcount = 0
+                self.rows = []
+
+        def copy_expert(self, command, fp):
+                m = re.match(r"\s*copy (?:\w+\.)?(\w+) from stdin with null as '([^']*)' delimiter as '(.)'", command, re.S)
+                table, null, delimiter = m.group(1), m.group(2), m.group(3)
+
+                rows = []
+                for line in fp:
+                        rows.append(splitRow(str.rstrip(line, '\n'), delimiter, null))
+
+                with db.lock:
+                        if self.separate:
+                                keys = db.committedKeys(table, rows)
+                                if len(keys) > 0:
+                                        raise Error('%s: key %s is committed (unique violation, or a wait on the db.py connection)' % (table, keys[0]))
+                        if len(rows) > 0:
+                                db.connect().executemany('insert into %s values (%s)' % \
+                                        (table, ','.join('?' * len(rows[0]))), rows)
+                self.rowcount = len(rows)
+                db.count(0)
+
+        def execute(self, command, args = None):
+                with db.lock:
+                        cursor = db.connect().execute(db.translate(command), args or ())
+                        self.rows = cursor.fetchall() if cursor.description else []
+                        self.rowcount = cursor.rowcount
+                db.count(len(self.rows))
+
+        def fetchone(self):
+                if len(self.rows) == 0:
+                        return None
+                return tuple(self.rows[0])
+
+        def fetchall(self):
+                return [tuple(r) for r in self.rows]
+
+        def fetchmany(self, size):
+                rows = self.rows[:size]
+                self.rows = self.rows[size:]
+                return [tuple(r) for r in rows]
+
+        def close(self):
+                pass
+
+class Connection:
+
+        def __init__(self, separate = 0):
+                self.separate = separate
+
+        def cursor(self, name = None):
+                return Cursor(self.separate)
+
+        def commit(self):
+                db.commit()
+
+        def rollback(self):
+                with db.lock:
+                        db.connect().rollback()
+
+        def close(self):
+                pass
+
+def connect(**kwargs):
+        return Connection(separate = 1)
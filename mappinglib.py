@@ -0,0 +1,1783 @@
+'''
+#
+# Purpose:
+#
+#	Lookup routines shared by mappingload.py and mappingonlyload.py
+#
+# Assumes:
+#
+#	db.py has been initialized by the calling load
+#	(db.set_sqlLogin, db.useOneConnection)
+#
+# History:
+#
+'''
+
+import sys
+import os
+import io
+import json
+import hashlib
+import shutil
+import tempfile
+import contextlib
+import sqlite3
+import threading
+import queue
+import array
+import bisect
+import gzip
+import bz2
+import lzma
+import time
+import psycopg2
+import db
+
+# max number of accession ids sent to the database in one query
+
+markerBatchSize = 500
+
+# compressed input: magic bytes / extension / open function (see openInput)
+compressions = [(b'\x1f\x8b', '.gz', gzip.open), \
+                (b'BZh', '.bz2', bz2.open), \
+                (b'\xfd7zXZ\x00', '.xz', lzma.open)]
+
+# run metrics (see instrumentSql, phase, writeMetrics):
+#	phases : phase name / {'seconds', 'queries', 'rows'}, in run order
+#	counters : name / value (lines processed, rows/bytes per bcp file, ...)
+
+metrics = {'phases' : {}, 'counters' : {}}
+currentPhase = None
+
+def instrumentSql():
+        '''
+        # requires:
+        #
+        # effects:
+        #	replaces db.sql with a version that counts the SQL calls and
+        #	rows fetched of the current phase (see phase)
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        sql = db.sql
+
+        if getattr(sql, 'instrumented', 0):
+                return
+
+        def countedSql(command, parser = 'auto', **kwargs):
+                results = sql(command, parser, **kwargs)
+                p = metrics['phases'].setdefault(currentPhase or 'other', {'seconds' : 0, 'queries' : 0, 'rows' : 0})
+                p['queries'] = p['queries'] + 1
+                if isinstance(results, list):
+                        p['rows'] = p['rows'] + len(results)
+                return results
+
+        countedSql.instrumented = 1
+        db.sql = countedSql
+
+@contextlib.contextmanager
+def phase(name):
+        '''
+        # requires:
+        #	name - name of the phase
+        #
+        # effects:
+        #	records the wall time of the enclosed block, and attributes
+        #	its SQL calls (see instrumentSql) to the phase
+        #	ex. with mappinglib.phase('init'):
+        #		init()
+        #
+        '''
+
+        global currentPhase
+
+        previous = currentPhase
+        currentPhase = name
+        p = metrics['phases'].setdefault(name, {'seconds' : 0, 'queries' : 0, 'rows' : 0})
+        start = time.time()
+
+        try:
+                yield p
+        finally:
+                p['seconds'] = p['seconds'] + time.time() - start
+                currentPhase = previous
+
+def setCounter(name, value):
+        '''
+        # requires:
+        #	name - name of the counter
+        #	value - value (number)
+        #
+        # effects:
+        #	records a run counter in metrics
+        #
+        '''
+
+        metrics['counters'][name] = value
+
+def addCounter(name, value):
+        '''
+        # requires:
+        #	name - name of the counter
+        #	value - value to add (number)
+        #
+        # effects:
+        #	adds to a run counter in metrics
+        #
+        '''
+
+        metrics['counters'][name] = metrics['counters'].get(name, 0) + value
+
+def writeMetrics(fileName, status):
+        '''
+        # requires:
+        #	fileName - name of the JSON metrics file
+        #	status - exit status of the run
+        #
+        # effects:
+        #	writes metrics as a JSON document, for the job scheduler
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        summary = {'status' : status, 'pid' : os.getpid(), 'end' : time.strftime('%Y-%m-%d %H:%M:%S')}
+        summary.update(metrics)
+        summary['seconds'] = sum([p['seconds'] for p in metrics['phases'].values()])
+
+        fp = open(fileName, 'w')
+        json.dump(summary, fp, indent = 2)
+        fp.write('\n')
+        fp.close()
+
+def sqlQuote(value):
+        '''
+        # requires:
+        #	value - string
+        #
+        # effects:
+        #	escapes embedded single quotes for use in a SQL string literal
+        #
+        # returns:
+        #	the quoted string
+        #
+        '''
+
+        return "'%s'" % (str.replace(value, "'", "''"))
+
+def resolveMarkers(markerIDs, batchSize = markerBatchSize):
+        '''
+        # requires:
+        #	markerIDs - iterable of Marker Accession IDs (ex. "MGI:12345")
+        #	batchSize - max number of ids per query
+        #
+        # effects:
+        #	resolves the mouse Marker for each accession id,
+        #	sending the ids to the database in batches of batchSize
+        #	instead of one query per id
+        #
+        # returns:
+        #	dictionary of accession id : (Marker key, Marker symbol)
+        #	ids that do not resolve to a mouse Marker are not returned
+        #
+        '''
+
+        markers = {}
+        markerIDs = sorted(set(markerIDs))
+
+        for i in range(0, len(markerIDs), batchSize):
+                batch = markerIDs[i:i + batchSize]
+                results = db.sql('''select a.accID, m._Marker_key, m.symbol
+                        from MRK_Marker m, MRK_Acc_View a
+                        where a.accID in (%s)
+                        and a._Object_key = m._Marker_key
+                        and m._Organism_key = 1''' % (','.join(map(sqlQuote, batch))), 'auto')
+                for r in results:
+                        markers[r['accID']] = (r['_Marker_key'], r['symbol'])
+
+        return markers
+
+def markerRows(batchSize = 10000):
+        '''
+        # requires:
+        #	batchSize - number of rows fetched at a time
+        #
+        # effects:
+        #	streams every accession id of every mouse Marker from one
+        #	query (server-side cursor on the db.py connection), without
+        #	holding the whole result in memory, in numeric part order
+        #
+        # returns:
+        #	generator of (accession id, Marker key, Marker symbol)
+        #
+        '''
+
+        cursor = getConnection().cursor('markerRows')
+        try:
+                cursor.execute('''select a.accID, m._Marker_key, m.symbol
+                        from MRK_Marker m, MRK_Acc_View a 
+                        where a._Object_key = m._Marker_key 
+                        and m._Organism_key = 1
+                        order by a.numericPart''')
+                while 1:
+                        rows = cursor.fetchmany(batchSize)
+                        if len(rows) == 0:
+                                break
+                        yield from rows
+        finally:
+                cursor.close()
+
+class MarkerIndex:
+        '''
+        # Compact index of every mouse Marker accession id:
+        # accession id / (Marker key, Marker symbol)
+        #
+        # The MGI ids ("MGI:<number>") are kept as a sorted array of their
+        # numeric parts, searched with a binary search; the Marker key and
+        # symbol number of each id are kept in arrays in the same order.
+        # Each symbol is kept once, in a table of its own (symbols).
+        # The other ids (other prefixes) are kept in a dictionary of id /
+        # position in the key and symbol arrays, after the MGI ids.
+        #
+        # find gives the position of an id: it parses the numeric part
+        # of the id (one substring and one int per lookup) and searches
+        # the array; markerKey and symbol read the arrays.  the lookup is
+        # not free of allocations, but nothing is kept per id.
+        '''
+
+        def __init__(self, rows):
+                '''
+                # requires:
+                #	rows - iterable of (accession id, Marker key, Marker symbol)
+                #	(see markerRows); if an id is repeated, the last row wins
+                #
+                '''
+
+                numbers = array.array('q')
+                keys = array.array('i')
+                symbolIds = array.array('i')
+                otherKeys = array.array('i')
+                otherSymbolIds = array.array('i')
+                symbolTable = {}
+                ordered = 1
+                self.symbols = []
+                self.other = {}
+
+                for markerID, markerKey, symbol in rows:
+                        if symbol not in symbolTable:
+                                symbolTable[symbol] = len(self.symbols)
+                                self.symbols.append(symbol)
+                        number = self.number(markerID)
+                        if number < 0:
+                                if markerID not in self.other:
+                                        self.other[markerID] = len(otherKeys)
+                                        otherKeys.append(0)
+                                        otherSymbolIds.append(0)
+                                otherKeys[self.other[markerID]] = markerKey
+                                otherSymbolIds[self.other[markerID]] = symbolTable[symbol]
+                        else:
+                                if len(numbers) > 0 and number < numbers[-1]:
+                                        ordered = 0
+                                numbers.append(number)
+                                keys.append(markerKey)
+                                symbolIds.append(symbolTable[symbol])
+
+                # sort by numeric part, unless the rows came in that order
+                # (see markerRows); the sort is stable
+                if not ordered:
+                        order = sorted(range(len(numbers)), key = numbers.__getitem__)
+                        numbers = array.array('q', (numbers[i] for i in order))
+                        keys = array.array('i', (keys[i] for i in order))
+                        symbolIds = array.array('i', (symbolIds[i] for i in order))
+                        del order
+
+                # a repeated id keeps its last row
+                repeated = [n for n in range(len(numbers) - 1) if numbers[n] == numbers[n + 1]]
+                for n in reversed(repeated):
+                        del numbers[n]
+                        del keys[n]
+                        del symbolIds[n]
+
+                self.numbers = numbers
+                self.keys = keys
+                self.symbolIds = symbolIds
+
+                for markerID in self.other:
+                        self.other[markerID] = self.other[markerID] + len(self.numbers)
+                self.keys.extend(otherKeys)
+                self.symbolIds.extend(otherSymbolIds)
+
+        def number(self, markerID):
+                '''
+                # returns:
+                #	the numeric part of an MGI id ("MGI:<number>", no
+                #	leading zero), or -1 for any other id
+                '''
+
+                if not markerID.startswith('MGI:'):
+                        return -1
+
+                digits = markerID[4:]
+                if digits.isdigit() and digits[0] != '0':
+                        return int(digits)
+                return -1
+
+        def find(self, markerID):
+                '''
+                # returns:
+                #	the position of markerID (see markerKey, symbol),
+                #	or -1 if it is not in the index
+                '''
+
+                number = self.number(markerID)
+                if number < 0:
+                        return self.other.get(markerID, -1)
+
+                i = bisect.bisect_left(self.numbers, number)
+                if i < len(self.numbers) and self.numbers[i] == number:
+                        return i
+                return -1
+
+        def markerKey(self, i):
+                '''
+                # returns:
+                #	the Marker key at position i (see find)
+                '''
+
+                return self.keys[i]
+
+        def symbol(self, i):
+                '''
+                # returns:
+                #	the Marker symbol at position i (see find)
+                '''
+
+                return self.symbols[self.symbolIds[i]]
+
+        def __len__(self):
+                return len(self.keys)
+
+        def items(self):
+                '''
+                # returns:
+                #	generator of (accession id, Marker key, Marker symbol)
+                #	of every id in the index
+                '''
+
+                for i in range(len(self.numbers)):
+                        yield 'MGI:%d' % (self.numbers[i]), self.keys[i], self.symbol(i)
+                for markerID, i in self.other.items():
+                        yield markerID, self.keys[i], self.symbol(i)
+
+        def resolve(self, markerIDs):
+                '''
+                # requires:
+                #	markerIDs - iterable of Marker Accession IDs
+                #
+                # returns:
+                #	dictionary of accession id : (Marker key, Marker symbol)
+                #	of the ids in the index (see resolveMarkers)
+                '''
+
+                markers = {}
+
+                for markerID in markerIDs:
+                        i = self.find(markerID)
+                        if i >= 0:
+                                markers[markerID] = (self.keys[i], self.symbol(i))
+
+                return markers
+
+def loadMarkerIndex():
+        '''
+        # requires:
+        #
+        # effects:
+        #	loads every accession id of every mouse Marker in one query
+        #	(cheaper than resolveMarkers once the number of ids to
+        #	resolve is large) into a compact index
+        #
+        # returns:
+        #	MarkerIndex
+        #
+        '''
+
+        return MarkerIndex(markerRows())
+
+def loadChromosomes():
+        '''
+        # requires:
+        #
+        # effects:
+        #	loads the valid mouse chromosomes
+        #
+        # returns:
+        #	list of chromosomes, in sequenceNum order
+        #
+        '''
+
+        results = db.sql('''select chromosome from MRK_Chromosome 
+                where _Organism_key = 1 
+                and chromosome not in ('UN') 
+                order by sequenceNum''', 'auto')
+
+        return [r['chromosome'] for r in results]
+
+def loadAssays():
+        '''
+        # requires:
+        #
+        # effects:
+        #	loads the mapping Assay Types
+        #
+        # returns:
+        #	dictionary of Assay Type description : Assay Type key
+        #
+        '''
+
+        assays = {}
+
+        results = db.sql('select * from MLD_Assay_Types', 'auto')
+        for r in results:
+                assays[r['description']] = r['_Assay_Type_key']
+
+        return assays
+
+def reserveKeys(sequence, count, claim = 1):
+        '''
+        # requires:
+        #	sequence - name of the key sequence (ex. mld_expts_seq)
+        #	count - number of keys
+        #	claim - if false, only read the next keys (preview)
+        #
+        # effects:
+        #	claims count keys from the sequence in one round trip
+        #	nextval() is atomic and is never rolled back, so the keys
+        #	cannot be given to any other load running at the same time
+        #	(the keys need not be consecutive)
+        #	preview: the sequence is not advanced; the keys are the ones
+        #	it would hand out next if no other load takes any
+        #
+        # returns:
+        #	list of keys, in ascending order
+        #
+        '''
+
+        if count <= 0:
+                return []
+
+        if not claim:
+                results = db.sql('''select last_value, is_called from %s''' % (sequence), 'auto')
+                nextKey = results[0]['last_value']
+                if results[0]['is_called']:
+                        nextKey = nextKey + 1
+                return list(range(nextKey, nextKey + count))
+
+        results = db.sql('''select nextval('%s') as nextKey from generate_series(1, %d)''' \
+                % (sequence, count), 'auto')
+
+        return sorted([r['nextKey'] for r in results])
+
+def advanceSequence(sequence, key):
+        '''
+        # requires:
+        #	sequence - name of the key sequence (ex. mld_expt_marker_seq)
+        #	key - the highest key loaded
+        #
+        # effects:
+        #	moves the sequence up to key, for keys that were not taken
+        #	from the sequence; does nothing if the sequence is past key
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        db.sql('''select setval('%s', %d) from %s where last_value < %d''' \
+                % (sequence, key, sequence, key), None)
+
+def claimAccessionMax(prefix, count, claim = 1, connection = None):
+        '''
+        # requires:
+        #	prefix - accession id prefix (ex. 'MGI:')
+        #	count - number of accession ids
+        #	claim - if false, only read the next number (preview)
+        #	connection - psycopg2 connection of the claim, separate
+        #		from the db.py connection (see connect)
+        #
+        # effects:
+        #	claims count consecutive numeric parts for prefix by moving
+        #	ACC_AccessionMax up in one update, committed at once on the
+        #	connection: the row is locked only for the update, and the
+        #	numbers are not given back if the load fails (gaps)
+        #
+        # returns:
+        #	the first numeric part claimed
+        #
+        '''
+
+        if not claim or count <= 0:
+                results = db.sql('''select maxNumericPart + 1 as nextKey from ACC_AccessionMax
+                        where prefixPart = '%s' ''' % (prefix), 'auto')
+                return results[0]['nextKey']
+
+        cursor = connection.cursor()
+        try:
+                cursor.execute('''update ACC_AccessionMax set maxNumericPart = maxNumericPart + %d
+                        where prefixPart = '%s'
+                        returning maxNumericPart''' % (count, prefix))
+                maxNumericPart = cursor.fetchone()[0]
+                connection.commit()
+        finally:
+                cursor.close()
+
+        return maxNumericPart - count + 1
+
+def snapshotStamp():
+        '''
+        # requires:
+        #
+        # effects:
+        #	computes the validation stamp of the lookups, in one query:
+        #	the max modification date and row count of the chromosome
+        #	and assay tables (both small), the max modification date
+        #	of MRK_Marker, and the max key and the number of the marker
+        #	accession ids (index lookups; the marker ACC_Accession rows
+        #	are counted, not read)
+        #
+        # returns:
+        #	the stamp of the chromosome and assay lookups (string),
+        #	the Marker modification date (string), the accession key
+        #	and the number of accession ids (see refreshSnapshot)
+        #
+        '''
+
+        results = db.sql('''select
+                (select max(modification_date) from MRK_Chromosome where _Organism_key = 1) as chrDate,
+                (select count(*) from MRK_Chromosome where _Organism_key = 1) as chrCount,
+                (select max(modification_date) from MLD_Assay_Types) as assayDate,
+                (select count(*) from MLD_Assay_Types) as assayCount,
+                (select max(modification_date) from MRK_Marker where _Organism_key = 1) as markerDate,
+                (select max(_Accession_key) from MRK_Acc_View) as accKey,
+                (select count(*) from MRK_Acc_View) as accCount''', 'auto')
+
+        r = results[0]
+        return '|'.join([str(r[c]) for c in ('chrDate', 'chrCount', 'assayDate', 'assayCount')]), \
+                str(r['markerDate']), r['accKey'] or 0, r['accCount']
+
+def buildSnapshot(fileName, stamp):
+        '''
+        # requires:
+        #	fileName - name of the snapshot file
+        #	stamp - validation stamp (see snapshotStamp)
+        #
+        # effects:
+        #	loads the chromosome, assay and marker lookups from the database
+        #	into a new SQLite snapshot file, which replaces fileName
+        #	in one step (so concurrent loads never see a partial snapshot)
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        tmpFileName = '%s.%d' % (fileName, os.getpid())
+        if os.path.exists(tmpFileName):
+                os.remove(tmpFileName)
+
+        snapshot = sqlite3.connect(tmpFileName)
+        snapshot.executescript('''
+                create table stamp (lookups text not null, markerDate text not null, accKey int not null,
+                        accCount int not null);
+                create table chromosome (sequenceNum int not null, chromosome text not null);
+                create table assay (description text not null, _Assay_Type_key int not null);
+                create table marker (accID text primary key, _Marker_key int not null, symbol text not null);
+                create index marker_key on marker (_Marker_key);
+                ''')
+
+        snapshot.executemany('insert into chromosome values (?, ?)', enumerate(loadChromosomes()))
+        snapshot.executemany('insert into assay values (?, ?)', loadAssays().items())
+        snapshot.executemany('insert or replace into marker values (?, ?, ?)', markerRows())
+        snapshot.execute('insert into stamp values (?, ?, ?, ?)', stamp)
+        snapshot.commit()
+        snapshot.close()
+
+        os.replace(tmpFileName, fileName)
+
+def refreshSnapshot(snapshot, stamp):
+        '''
+        # requires:
+        #	snapshot - sqlite3 connection (see openSnapshot)
+        #	stamp - validation stamp of the database (see snapshotStamp)
+        #		with the same chromosome and assay stamp as the snapshot
+        #
+        # effects:
+        #	brings the marker lookups of the snapshot up to date, in one
+        #	transaction, by reloading only the Markers modified since the
+        #	snapshot (ex. the chromosome updates of mappingonlyload) and
+        #	those with new accession ids.  the ids the snapshot had for
+        #	those Markers that are now elsewhere (ex. a merge) are
+        #	looked up again.
+        #	a deleted Marker or accession id leaves no trace to reload
+        #	from: if the number of accession ids is not that of the
+        #	snapshot plus the new ones, nothing is done
+        #
+        # returns:
+        #	1 if the snapshot was brought up to date, 0 if accession
+        #	ids were deleted (the snapshot must be rebuilt)
+        #
+        '''
+
+        lookups, markerDate, accKey, accCount = \
+                snapshot.execute('select lookups, markerDate, accKey, accCount from stamp').fetchone()
+
+        newIDs = db.sql('select _Object_key from MRK_Acc_View where _Accession_key > %d' % (accKey), 'auto')
+        if accCount + len(newIDs) != stamp[3]:
+                return 0
+
+        markerKeys = set()
+        if markerDate != 'None':
+                for r in db.sql('''select _Marker_key from MRK_Marker
+                        where _Organism_key = 1
+                        and modification_date > '%s' ''' % (markerDate), 'auto'):
+                        markerKeys.add(r['_Marker_key'])
+        for r in newIDs:
+                markerKeys.add(r['_Object_key'])
+
+        markerKeys = sorted(markerKeys)
+        oldIDs = set()
+        newIDs = set()
+
+        with snapshot:
+                for i in range(0, len(markerKeys), markerBatchSize):
+                        keys = ','.join([str(k) for k in markerKeys[i:i + markerBatchSize]])
+                        oldIDs.update([r[0] for r in snapshot.execute( \
+                                'select accID from marker where _Marker_key in (%s)' % (keys))])
+                        snapshot.execute('delete from marker where _Marker_key in (%s)' % (keys))
+                        results = db.sql('''select a.accID, m._Marker_key, m.symbol
+                                from MRK_Marker m, MRK_Acc_View a
+                                where m._Marker_key in (%s)
+                                and a._Object_key = m._Marker_key
+                                and m._Organism_key = 1''' % (keys), 'auto')
+                        snapshot.executemany('insert or replace into marker values (?, ?, ?)', \
+                                [(r['accID'], r['_Marker_key'], r['symbol']) for r in results])
+                        newIDs.update([r['accID'] for r in results])
+
+                moved = resolveMarkers(oldIDs - newIDs)
+                snapshot.executemany('insert or replace into marker values (?, ?, ?)', \
+                        [(markerID, moved[markerID][0], moved[markerID][1]) for markerID in moved])
+
+                snapshot.execute('update stamp set markerDate = ?, accKey = ?, accCount = ?', stamp[1:])
+
+        return 1
+
+def openSnapshot(fileName):
+        '''
+        # requires:
+        #	fileName - name of the snapshot file
+        #
+        # effects:
+        #	checks the snapshot against the database (snapshotStamp);
+        #	rebuilds it if it is missing, its chromosome or assay
+        #	lookups are stale or Marker accession ids were deleted,
+        #	or refreshes the Markers that have changed (refreshSnapshot)
+        #
+        # returns:
+        #	sqlite3 connection to the snapshot
+        #
+        '''
+
+        stamp = snapshotStamp()
+
+        try:
+                snapshot = sqlite3.connect(fileName)
+                version = snapshot.execute('select lookups, markerDate, accKey, accCount from stamp').fetchone()
+                if version[0] == stamp[0]:
+                        if tuple(version) == tuple(stamp) or refreshSnapshot(snapshot, stamp):
+                                return snapshot
+                snapshot.close()
+        except sqlite3.Error:
+                pass
+
+        buildSnapshot(fileName, stamp)
+        return sqlite3.connect(fileName)
+
+def snapshotVersion(snapshot):
+        '''
+        # requires:
+        #	snapshot - sqlite3 connection (see openSnapshot)
+        #
+        # returns:
+        #	the validation stamp of the snapshot (string)
+        #
+        '''
+
+        return '|'.join([str(value) for value in \
+                snapshot.execute('select lookups, markerDate, accKey, accCount from stamp').fetchone()])
+
+def snapshotChromosomes(snapshot):
+        '''
+        # requires:
+        #	snapshot - sqlite3 connection (see openSnapshot)
+        #
+        # returns:
+        #	list of chromosomes, in sequenceNum order (see loadChromosomes)
+        #
+        '''
+
+        return [r[0] for r in snapshot.execute('select chromosome from chromosome order by sequenceNum')]
+
+def snapshotAssays(snapshot):
+        '''
+        # requires:
+        #	snapshot - sqlite3 connection (see openSnapshot)
+        #
+        # returns:
+        #	dictionary of Assay Type description : Assay Type key (see loadAssays)
+        #
+        '''
+
+        return dict(snapshot.execute('select description, _Assay_Type_key from assay'))
+
+def snapshotMarkers(snapshot, markerIDs = None, batchSize = markerBatchSize):
+        '''
+        # requires:
+        #	snapshot - sqlite3 connection (see openSnapshot)
+        #	markerIDs - iterable of Marker Accession IDs (None = all Markers)
+        #	batchSize - max number of ids per query
+        #
+        # returns:
+        #	dictionary of accession id : (Marker key, Marker symbol)
+        #	(see resolveMarkers)
+        #
+        '''
+
+        markers = {}
+
+        if markerIDs is None:
+                for markerID, markerKey, symbol in snapshot.execute('select accID, _Marker_key, symbol from marker'):
+                        markers[markerID] = (markerKey, symbol)
+                return markers
+
+        markerIDs = sorted(set(markerIDs))
+
+        for i in range(0, len(markerIDs), batchSize):
+                batch = markerIDs[i:i + batchSize]
+                for markerID, markerKey, symbol in snapshot.execute('''select accID, _Marker_key, symbol
+                        from marker where accID in (%s)''' % (','.join('?' * len(batch))), batch):
+                        markers[markerID] = (markerKey, symbol)
+
+        return markers
+
+def snapshotMarkerIndex(snapshot):
+        '''
+        # requires:
+        #	snapshot - sqlite3 connection (see openSnapshot)
+        #
+        # returns:
+        #	MarkerIndex of every Marker of the snapshot (see loadMarkerIndex)
+        #
+        '''
+
+        return MarkerIndex(snapshot.execute('select accID, _Marker_key, symbol from marker'))
+
+def lineHash(fields):
+        '''
+        # requires:
+        #	fields - the fields of an input record after the
+        #		Experiment Marker key (tokens[1:]); the key is
+        #		reserved anew on each mappingonlyload run
+        #
+        # returns:
+        #	content hash of the record (see openPreviewCache)
+        #
+        '''
+
+        return hashlib.sha1('|'.join(fields).encode()).hexdigest()
+
+def previewStamp(snapshot = None):
+        '''
+        # requires:
+        #	snapshot - sqlite3 connection (see openSnapshot), or None
+        #
+        # returns:
+        #	the validation stamp of the marker lookups of a preview run:
+        #	that of the snapshot, or of the database (snapshotStamp)
+        #
+        '''
+
+        if snapshot is not None:
+                return snapshotVersion(snapshot)
+        else:
+                return '|'.join([str(value) for value in snapshotStamp()])
+
+def cachedMarkers(cache, hashes):
+        '''
+        # requires:
+        #	cache - the preview cache (see openPreviewCache)
+        #	hashes - list of (record hash, marker id) of the records
+        #
+        # returns:
+        #	the set of the marker ids of the records found in cache,
+        #	the lookups of those that are valid (marker id /
+        #	(Marker key, Marker symbol)) and the number of hits
+        #
+        '''
+
+        cachedIDs = set()
+        cached = {}
+        hits = 0
+
+        for recordHash, markerID in hashes:
+                if recordHash in cache:
+                        hits = hits + 1
+                        cachedIDs.add(markerID)
+                        if cache[recordHash] is not None:
+                                cached[markerID] = cache[recordHash]
+
+        return cachedIDs, cached, hits
+
+def openPreviewCache(fileName, stamp):
+        '''
+        # requires:
+        #	fileName - name of the preview cache file
+        #	stamp - validation stamp of the lookups (see snapshotStamp)
+        #
+        # effects:
+        #	reads the marker lookups of the records validated by the
+        #	last preview run, if they were checked against the same stamp
+        #
+        # returns:
+        #	dictionary of record hash (lineHash) / (Marker key, Marker symbol),
+        #	or None if the Marker was not found; empty if the cache is
+        #	missing or stale
+        #
+        '''
+
+        lines = {}
+
+        try:
+                cache = sqlite3.connect(fileName)
+                if cache.execute('select stamp from stamp').fetchone()[0] == stamp:
+                        for recordHash, markerKey, symbol in cache.execute('select hash, _Marker_key, symbol from line'):
+                                if markerKey is None:
+                                        lines[recordHash] = None
+                                else:
+                                        lines[recordHash] = (markerKey, symbol)
+                cache.close()
+        except sqlite3.Error:
+                pass
+
+        return lines
+
+def writePreviewCache(fileName, stamp, lines):
+        '''
+        # requires:
+        #	fileName - name of the preview cache file
+        #	stamp - validation stamp of the lookups (see snapshotStamp)
+        #	lines - dictionary of the records of this run (see openPreviewCache)
+        #
+        # effects:
+        #	replaces the preview cache file in one step
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        tmpFileName = '%s.%d' % (fileName, os.getpid())
+        if os.path.exists(tmpFileName):
+                os.remove(tmpFileName)
+
+        cache = sqlite3.connect(tmpFileName)
+        cache.executescript('''
+                create table stamp (stamp text not null);
+                create table line (hash text primary key, _Marker_key int null, symbol text null);
+                ''')
+        cache.executemany('insert into line values (?, ?, ?)', \
+                [(recordHash, marker and marker[0], marker and marker[1]) for recordHash, marker in lines.items()])
+        cache.execute('insert into stamp values (?)', (stamp,))
+        cache.commit()
+        cache.close()
+
+        os.replace(tmpFileName, fileName)
+
+def fileChecksum(fp):
+        '''
+        # requires:
+        #	fp - file pointer (or staging buffer), text or binary
+        #
+        # effects:
+        #	reads fp from its start; fp is left positioned at its start
+        #
+        # returns:
+        #	sha1 of the content of fp
+        #
+        '''
+
+        checksum = hashlib.sha1()
+
+        fp.seek(0)
+        while 1:
+                data = fp.read(1048576)
+                if len(data) == 0:
+                        break
+                if isinstance(data, str):
+                        data = data.encode()
+                checksum.update(data)
+        fp.seek(0)
+
+        return checksum.hexdigest()
+
+def readManifest(fileName):
+        '''
+        # requires:
+        #	fileName - name of the JSON run manifest
+        #
+        # effects:
+        #	reads the run manifest; raises the error if it cannot be read
+        #
+        # returns:
+        #	the manifest (dictionary)
+        #
+        '''
+
+        fp = open(fileName, 'r')
+        manifest = json.load(fp)
+        fp.close()
+
+        return manifest
+
+def writeManifest(fileName, manifest):
+        '''
+        # requires:
+        #	fileName - name of the JSON run manifest
+        #	manifest - dictionary
+        #
+        # effects:
+        #	replaces the run manifest in one step, so that a crash
+        #	leaves the previous version
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        tmpFileName = '%s.%d' % (fileName, os.getpid())
+
+        fp = open(tmpFileName, 'w')
+        json.dump(manifest, fp, indent = 2)
+        fp.write('\n')
+        fp.close()
+
+        os.replace(tmpFileName, fileName)
+
+class ErrorCollector:
+        '''
+        # Collects the errors of the input records
+        #
+        # The errors are grouped by kind (ex. 'Invalid Mouse Marker') and
+        # offending value, with the number of lines and the first line
+        # numbers of each group, for a compact summary (see summary).
+        # The error text of each line is also written to an optional
+        # detail file, up to a limit.
+        #
+        # With keepEvents, the errors are only kept in order (events),
+        # to be replayed into the collector of the main process.
+        '''
+
+        def __init__(self, detailFile = None, detailLimit = 0, lineLimit = 10, keepEvents = 0, valueLimit = 100):
+                '''
+                # requires:
+                #	detailFile - file pointer of the detail file (optional)
+                #	detailLimit - max number of lines written to detailFile
+                #	lineLimit - max number of line numbers kept per group
+                #	keepEvents - only keep the errors (see replay)
+                #	valueLimit - max number of values listed per kind
+                #
+                '''
+
+                self.detailFile = detailFile
+                self.detailLimit = detailLimit
+                self.detailCount = 0
+                self.lineLimit = lineLimit
+                self.valueLimit = valueLimit
+                self.groups = {}
+                self.total = 0
+                self.source = ''
+                self.events = None
+                if keepEvents:
+                        self.events = []
+
+        def add(self, kind, value, lineNum, text):
+                '''
+                # requires:
+                #	kind - the kind of error
+                #	value - the offending value
+                #	lineNum - line number of the record
+                #	text - the error text of the line (detail file)
+                #
+                # effects:
+                #	counts the error in its group
+                '''
+
+                if self.events is not None:
+                        self.events.append((kind, value, lineNum, text))
+                        return
+
+                if self.source != '':
+                        lineNum = '%s:%d' % (self.source, lineNum)
+
+                group = self.groups.get((kind, value))
+                if group is None:
+                        group = [0, []]
+                        self.groups[(kind, value)] = group
+
+                group[0] = group[0] + 1
+                if len(group[1]) < self.lineLimit:
+                        group[1].append(str(lineNum))
+                self.total = self.total + 1
+
+                if self.detailFile is not None and self.detailCount < self.detailLimit:
+                        self.detailFile.write(text)
+                        self.detailCount = self.detailCount + 1
+                        if self.detailCount == self.detailLimit:
+                                self.detailFile.write('... (detail limit of %d lines reached)\n' % (self.detailLimit))
+
+        def replay(self, events):
+                '''
+                # requires:
+                #	events - the events of a keepEvents collector
+                #
+                # effects:
+                #	adds the errors, in order
+                '''
+
+                for kind, value, lineNum, text in events:
+                        self.add(kind, value, lineNum, text)
+
+        def summary(self, fp):
+                '''
+                # requires:
+                #	fp - file pointer of the error file
+                #
+                # effects:
+                #	writes one line per kind of error and per offending
+                #	value (up to valueLimit values per kind), with its
+                #	number of lines and first line numbers
+                '''
+
+                if self.total == 0:
+                        return
+
+                kinds = {}
+                for kind, value in self.groups:
+                        kinds.setdefault(kind, []).append(value)
+
+                fp.write('Errors: %d lines\n' % (self.total))
+
+                for kind in kinds:
+                        fp.write('\n%s: %d lines\n' % (kind, sum([self.groups[(kind, value)][0] for value in kinds[kind]])))
+                        for value in kinds[kind][:self.valueLimit]:
+                                count, lines = self.groups[(kind, value)]
+                                more = ''
+                                if count > len(lines):
+                                        more = ', ...'
+                                fp.write('\t%s : %d lines (%s%s)\n' % (value, count, ', '.join(lines), more))
+                        if len(kinds[kind]) > self.valueLimit:
+                                fp.write('\t... %d more values\n' % (len(kinds[kind]) - self.valueLimit))
+
+class ChecksumReader(io.RawIOBase):
+        '''
+        # requires:
+        #	fileName - name of an input file
+        #
+        # effects:
+        #	reads the file as it is stored (not decompressed) and adds
+        #	the bytes read to a sha1, so that the checksum is taken as
+        #	the input is streamed (see openInput, fileChecksum)
+        #
+        '''
+
+        def __init__(self, fileName):
+                io.RawIOBase.__init__(self)
+                self.fp = open(fileName, 'rb')
+                self.checksum = hashlib.sha1()
+
+        def readable(self):
+                return True
+
+        def readinto(self, buffer):
+                n = self.fp.readinto(buffer)
+                if n:
+                        self.checksum.update(memoryview(buffer)[:n])
+                return n
+
+        def drain(self):
+                # the bytes past what was read (ex. after the end of a
+                # compressed stream)
+                while not self.fp.closed:
+                        data = self.fp.read(1048576)
+                        if len(data) == 0:
+                                break
+                        self.checksum.update(data)
+
+        def close(self):
+                self.drain()
+                self.fp.close()
+                io.RawIOBase.close(self)
+
+        def hexdigest(self):
+                '''
+                # returns:
+                #	sha1 of the whole file (the same as fileChecksum)
+                '''
+
+                self.drain()
+                return self.checksum.hexdigest()
+
+def openInput(fileName, reader = None):
+        '''
+        # requires:
+        #	fileName - name of an input file, or '-' for stdin
+        #	reader - ChecksumReader of fileName, or None
+        #
+        # effects:
+        #	opens the input file (or stdin) for reading as text;
+        #	gzip, bz2 and xz input is decompressed as it is read.
+        #	the compression is detected by the magic bytes of the
+        #	input, or the extension of fileName if the input is empty.
+        #	the file is read through the reader if there is one.
+        #	raises the error if the file cannot be opened
+        #
+        # returns:
+        #	file pointer, and 1 if it is a plain file (it can be read
+        #	again with seek), 0 if not (stdin, compressed input, reader)
+        #
+        '''
+
+        if fileName == '-':
+                fp = sys.stdin.buffer
+                magic = fp.peek(6)
+        elif reader is not None:
+                fp = io.BufferedReader(reader)
+                magic = fp.peek(6)
+        else:
+                fp = open(fileName, 'rb')
+                magic = fp.read(6)
+                fp.seek(0)
+                fp.close()
+                fp = fileName
+
+        for compressMagic, extension, compressOpen in compressions:
+                if magic.startswith(compressMagic) or \
+                   (len(magic) == 0 and fileName.endswith(extension)):
+                        return compressOpen(fp, 'rt'), 0
+
+        if fileName == '-':
+                return sys.stdin, 0
+
+        if reader is not None:
+                return io.TextIOWrapper(fp), 0
+
+        return open(fileName, 'r'), 1
+
+def stagingFile(maxSize):
+        '''
+        # requires:
+        #	maxSize - number of bytes kept in memory
+        #
+        # effects:
+        #	creates a staging buffer for bcp rows: the rows are kept in
+        #	memory up to maxSize, beyond that in a local temporary file
+        #	(in TMPDIR, removed when the buffer is closed)
+        #
+        # returns:
+        #	file pointer of the staging buffer
+        #
+        '''
+
+        return tempfile.SpooledTemporaryFile(max_size = maxSize, mode = 'w+', prefix = 'mappingload.')
+
+def copyFile(fp, fileName):
+        '''
+        # requires:
+        #	fp - staging buffer (see stagingFile)
+        #	fileName - name of the file to write
+        #
+        # effects:
+        #	writes the content of the staging buffer to fileName
+        #	the buffer is left positioned at its end
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        fp.seek(0)
+        outFile = open(fileName, 'w')
+        shutil.copyfileobj(fp, outFile)
+        outFile.close()
+
+class BcpWriter:
+        '''
+        # Writes the rows of one bcp file ("copy ... from stdin" text format)
+        #
+        # The row layout is compiled once from the column list: constant
+        # columns (ex. creation_date) are formatted when the writer is
+        # created, and each row is one string formatting of the variable
+        # columns.  Text columns are escaped (backslash, delimiter,
+        # newline, carriage return) so that they cannot break the row.
+        # Rows are buffered and written to fp in large blocks.
+        #
+        # Keeps the number of rows and bytes written (rows, bytes).
+        #
+        # If the writer is attached to a WriterStage (stage), write only
+        # queues the row; it is formatted and written by the stage's thread.
+        '''
+
+        def __init__(self, fp, columns, constants = {}, text = (), delimiter = '|', bufferRows = 1000):
+                '''
+                # requires:
+                #	fp - file pointer (or in-memory buffer) of the bcp file
+                #	columns - list of the column names of the table
+                #	constants - dictionary of column name / value of the
+                #		columns that are the same on every row
+                #	text - the variable columns that need escaping
+                #	delimiter - column delimiter
+                #	bufferRows - number of rows held before writing to fp
+                #
+                '''
+
+                self.fp = fp
+                self.stage = None
+                self.bufferRows = bufferRows
+                self.buffer = []
+                self.rows = 0
+                self.bytes = 0
+
+                self.escapes = str.maketrans({'\\' : '\\\\', delimiter : '\\' + delimiter, \
+                                              '\n' : '\\n', '\r' : '\\r'})
+
+                layout = []
+                variable = []
+                for column in columns:
+                        if column in constants:
+                                layout.append(str.replace(self.escape(constants[column]), '%', '%%'))
+                        else:
+                                layout.append('%s')
+                                variable.append(column)
+
+                self.layout = delimiter.join(layout) + '\n'
+                self.textColumns = [i for i in range(len(variable)) if variable[i] in text]
+
+        def escape(self, value):
+                '''
+                # returns:
+                #	value as a str, escaped for the bcp file
+                '''
+
+                return str.translate(str(value), self.escapes)
+
+        def write(self, *values):
+                '''
+                # requires:
+                #	values - the values of the variable columns, in order
+                #
+                # effects:
+                #	adds one row (see add), or queues it to the stage
+                '''
+
+                if self.stage is not None:
+                        self.stage.put(self, values)
+                        return
+
+                self.add(values)
+
+        def add(self, values):
+                '''
+                # requires:
+                #	values - tuple of the values of the variable columns
+                #
+                # effects:
+                #	formats and buffers one row
+                '''
+
+                if self.textColumns:
+                        values = list(values)
+                        for i in self.textColumns:
+                                values[i] = str.translate(str(values[i]), self.escapes)
+                        values = tuple(values)
+
+                self.buffer.append(self.layout % values)
+                self.rows = self.rows + 1
+
+                if len(self.buffer) >= self.bufferRows:
+                        self.flush()
+
+        def flush(self):
+                '''
+                # effects:
+                #	writes the buffered rows to fp
+                '''
+
+                if len(self.buffer) == 0:
+                        return
+
+                block = ''.join(self.buffer)
+                self.buffer = []
+                self.bytes = self.bytes + len(block.encode())
+                self.fp.write(block)
+
+class InputError(Exception):
+        '''
+        # An input line that cannot be parsed
+        #
+        # Raised by the record generators instead of exiting, since they
+        # may run in the reader thread of a pipeline (see readerStage);
+        # the caller reports it and exits.
+        '''
+
+class WriterStage:
+        '''
+        # Writer stage of a pipeline: formats and writes the rows of
+        # BcpWriters in a thread of its own
+        #
+        # The rows written to the attached writers are passed to the thread
+        # in batches, in order, through a bounded queue; when the queue is
+        # full, the writing thread waits (back pressure).
+        # The thread is started with the first batch, so that a process
+        # forked before that (ex. a multiprocessing Pool) has no threads.
+        '''
+
+        def __init__(self, writers, queueSize = 8, batchRows = 1000):
+                '''
+                # requires:
+                #	writers - the BcpWriters to attach to the stage
+                #	queueSize - max number of batches in the queue
+                #	batchRows - number of rows per batch
+                #
+                '''
+
+                self.writers = writers
+                self.queue = queue.Queue(queueSize)
+                self.batchRows = batchRows
+                self.batch = []
+                self.thread = None
+                self.error = None
+
+                for writer in writers:
+                        writer.stage = self
+
+        def put(self, writer, values):
+                '''
+                # effects:
+                #	queues one row of writer
+                '''
+
+                self.batch.append((writer, values))
+                if len(self.batch) >= self.batchRows:
+                        self.send()
+
+        def send(self):
+                '''
+                # effects:
+                #	passes the queued rows to the thread;
+                #	raises the error of the thread, if any
+                '''
+
+                if self.error is not None:
+                        raise self.error
+
+                if self.thread is None:
+                        self.thread = threading.Thread(target = self.run, daemon = True)
+                        self.thread.start()
+
+                self.queue.put(self.batch)
+                self.batch = []
+
+        def run(self):
+                '''
+                # effects:
+                #	the thread: writes the batches until close;
+                #	after an error, the batches are only taken off the queue
+                '''
+
+                while 1:
+                        batch = self.queue.get()
+                        if batch is None:
+                                return
+                        if self.error is not None:
+                                continue
+                        try:
+                                for writer, values in batch:
+                                        writer.add(values)
+                        except BaseException as message:
+                                self.error = message
+
+        def close(self):
+                '''
+                # effects:
+                #	writes the remaining rows, stops the thread and detaches
+                #	the writers; raises the error of the thread, if any
+                '''
+
+                if len(self.batch) > 0:
+                        self.send()
+
+                if self.thread is not None:
+                        self.queue.put(None)
+                        self.thread.join()
+
+                for writer in self.writers:
+                        writer.stage = None
+
+                if self.error is not None:
+                        raise self.error
+
+def readerStage(records, queueSize = 8, batchSize = 1000):
+        '''
+        # requires:
+        #	records - iterable (ex. generator of input records)
+        #	queueSize - max number of batches in the queue
+        #	batchSize - number of records per batch
+        #
+        # effects:
+        #	reader stage of a pipeline: iterates records in a thread of
+        #	its own (started on the first request for a record) and
+        #	passes them on in batches, in order, through a bounded queue;
+        #	the thread waits while the queue is full (back pressure),
+        #	and stops if the caller stops reading.
+        #	an error of the thread (any exception, SystemExit included)
+        #	is raised to the caller; records should raise InputError
+        #	rather than exit, since they run in the thread
+        #
+        # returns:
+        #	generator of the records
+        #
+        '''
+
+        batches = queue.Queue(queueSize)
+        stop = threading.Event()
+
+        def put(item):
+                while not stop.is_set():
+                        try:
+                                batches.put(item, timeout = 0.1)
+                                return
+                        except queue.Full:
+                                pass
+
+        def run():
+                batch = []
+                try:
+                        for record in records:
+                                batch.append(record)
+                                if len(batch) >= batchSize:
+                                        put(batch)
+                                        batch = []
+                                        if stop.is_set():
+                                                return
+                        put(batch)
+                        put(None)
+                except BaseException as message:
+                        put(message)
+
+        thread = threading.Thread(target = run, daemon = True)
+        thread.start()
+
+        try:
+                while 1:
+                        batch = batches.get()
+                        if batch is None:
+                                break
+                        if isinstance(batch, BaseException):
+                                raise batch
+                        yield from batch
+        finally:
+                stop.set()
+
+def getConnection():
+        '''
+        # requires:
+        #	db.useOneConnection(1) has been called
+        #
+        # effects:
+        #	opens the shared db.py connection if it is not open yet
+        #
+        # returns:
+        #	the shared db.py (psycopg2) connection
+        #
+        '''
+
+        if db.sharedDbConn is None:
+                db.sql('select 1', 'auto')
+
+        return db.sharedDbConn
+
+def bcpCopy(table, fp, delimiter = '|', schema = 'mgd', connection = None, null = ''):
+        '''
+        # requires:
+        #	table - name of the table to load
+        #	fp - file pointer (or in-memory buffer) of bcp rows
+        #	delimiter - column delimiter of the bcp rows
+        #	schema - schema of the table
+        #	connection - psycopg2 connection (default: getConnection())
+        #	null - string that represents a null value
+        #
+        # effects:
+        #	streams the rows of fp into the table using
+        #	"copy ... from stdin" on the connection
+        #	(by default, same null/delimiter handling as bcpin.csh)
+        #	does not commit; raises the database error if the load fails
+        #
+        # returns:
+        #	the number of rows loaded
+        #
+        '''
+
+        if connection is None:
+                connection = getConnection()
+
+        fp.seek(0)
+        cursor = connection.cursor()
+        try:
+                cursor.copy_expert('''copy %s.%s from stdin with null as '%s' delimiter as '%s' ''' \
+                        % (schema, table, null, delimiter), fp)
+                return cursor.rowcount
+        finally:
+                cursor.close()
+
+def tableRows(table, schema = 'mgd'):
+        '''
+        # requires:
+        #	table - name of the table
+        #	schema - schema of the table
+        #
+        # returns:
+        #	the planner's estimate of the number of rows of the table
+        #	(pg_class.reltuples; 0 if it has never been analyzed)
+        #
+        '''
+
+        results = db.sql('''select c.reltuples
+                from pg_class c, pg_namespace n
+                where c.relnamespace = n.oid
+                and n.nspname = '%s'
+                and c.relname = '%s'
+                ''' % (schema, str.lower(table)), 'auto')
+
+        if len(results) == 0:
+                return 0
+
+        return max(int(results[0]['reltuples']), 0)
+
+def bcpCopyBulk(table, fp, delimiter = '|', schema = 'mgd', connection = None, null = '', triggers = ()):
+        '''
+        # requires:
+        #	see bcpCopy
+        #	triggers - names of the triggers of the table to disable
+        #		during the load (the others, and the foreign key
+        #		checks, stay on)
+        #
+        # effects:
+        #	bcpCopy for large loads; in the same transaction:
+        #	drops the secondary indexes of the table (not those of a
+        #	primary key, unique index or constraint) and disables the
+        #	given triggers, loads the rows, recreates the indexes,
+        #	enables the triggers and runs ANALYZE on the table.
+        #	PostgreSQL DDL is transactional: if anything fails, the
+        #	caller's rollback restores the indexes and triggers.
+        #	the table is locked (access exclusive) until the commit, so
+        #	the connection must be the one holding any other lock on it
+        #	(the db.py connection, the default)
+        #
+        # returns:
+        #	the number of rows loaded
+        #
+        '''
+
+        if connection is None:
+                connection = getConnection()
+
+        cursor = connection.cursor()
+        try:
+                cursor.execute('''select c.relname, pg_get_indexdef(i.indexrelid)
+                        from pg_index i, pg_class c, pg_class t, pg_namespace n
+                        where i.indexrelid = c.oid
+                        and i.indrelid = t.oid
+                        and t.relnamespace = n.oid
+                        and n.nspname = '%s'
+                        and t.relname = '%s'
+                        and not i.indisprimary
+                        and not i.indisunique
+                        and not exists (select 1 from pg_constraint k where k.conindid = i.indexrelid)''' \
+                        % (schema, str.lower(table)))
+                indexes = cursor.fetchall()
+
+                for name, definition in indexes:
+                        cursor.execute('drop index %s.%s' % (schema, name))
+                for name in triggers:
+                        cursor.execute('alter table %s.%s disable trigger %s' % (schema, table, name))
+
+                rows = bcpCopy(table, fp, delimiter, schema, connection, null)
+
+                for name, definition in indexes:
+                        cursor.execute(definition)
+                for name in triggers:
+                        cursor.execute('alter table %s.%s enable trigger %s' % (schema, table, name))
+                cursor.execute('analyze %s.%s' % (schema, table))
+
+                return rows
+        finally:
+                cursor.close()
+
+def connect(server, database, user, password):
+        '''
+        # requires:
+        #	server, database, user, password - login (see db.set_sqlLogin)
+        #
+        # effects:
+        #	opens a new connection, separate from the db.py connection
+        #
+        # returns:
+        #	psycopg2 connection
+        #
+        '''
+
+        return psycopg2.connect(host = server, dbname = database, user = user, password = password)
+
+def bcpSchedule(loads, depends):
+        '''
+        # requires:
+        #	loads - list of (table, fp) in load order
+        #	depends - dictionary of table : table that must be loaded first
+        #
+        # effects:
+        #	groups the loads into chains; a table is put in the same
+        #	chain as the table it depends on, after it.
+        #	chains have no dependencies on each other.
+        #
+        # returns:
+        #	list of chains, each a list of (table, fp)
+        #
+        '''
+
+        chains = []
+        chainOf = {}
+
+        for table, fp in loads:
+                if table in depends and depends[table] in chainOf:
+                        chain = chainOf[depends[table]]
+                else:
+                        chain = []
+                        chains.append(chain)
+                chain.append((table, fp))
+                chainOf[table] = chain
+
+        return chains
+
+def bcpCopySerial(loads, bulk = (), delimiter = '|', schema = 'mgd', triggers = {}):
+        '''
+        # requires:
+        #	loads - list of (table, fp) in load order
+        #	bulk - the tables to load with bcpCopyBulk
+        #	delimiter - column delimiter of the bcp rows
+        #	schema - schema of the tables
+        #	triggers - dictionary of bulk table : the names of its
+        #		triggers to disable (see bcpCopyBulk)
+        #
+        # effects:
+        #	loads the tables in order on the db.py connection
+        #	(bcpCopy, or bcpCopyBulk for the bulk tables);
+        #	stops at the first failed table.
+        #	does not commit
+        #
+        # returns:
+        #	dictionary of table : (rows, seconds, error) (see bcpCopyParallel)
+        #
+        '''
+
+        results = {}
+
+        for table, fp in loads:
+                results[table] = (0, 0, 'not loaded')
+
+        for table, fp in loads:
+                start = time.time()
+                try:
+                        if table in bulk:
+                                rows = bcpCopyBulk(table, fp, delimiter, schema, triggers = triggers.get(table, ()))
+                        else:
+                                rows = bcpCopy(table, fp, delimiter, schema)
+                except Exception as message:
+                        results[table] = (0, time.time() - start, message)
+                        break
+                results[table] = (rows, time.time() - start, None)
+
+        return results
+
+def bcpCopyParallel(loads, depends, connect, delimiter = '|', schema = 'mgd'):
+        '''
+        # requires:
+        #	loads - list of (table, fp) in load order
+        #	depends - dictionary of table : table that must be loaded first
+        #	connect - function returning a new psycopg2 connection
+        #	delimiter - column delimiter of the bcp rows
+        #	schema - schema of the tables
+        #
+        # effects:
+        #	loads each chain of tables (see bcpSchedule) in its own thread,
+        #	on its own connection, with bcpCopy; the tables of a chain are
+        #	loaded in order, in one transaction, so a table can see the
+        #	rows of the table it depends on.
+        #	a chain stops at its first failed table.
+        #	does not commit: the caller commits (or rolls back) every
+        #	returned connection once all loads have finished.
+        #
+        # returns:
+        #	list of connections, one per chain
+        #	dictionary of table : (rows, seconds, error)
+        #		error is None if the table loaded,
+        #		rows/seconds are 0 if the table failed or was not loaded
+        #
+        '''
+
+        chains = bcpSchedule(loads, depends)
+        connections = []
+        threads = []
+        results = {}
+
+        for table, fp in loads:
+                results[table] = (0, 0, 'not loaded')
+
+        def loadChain(chain, connection):
+                for table, fp in chain:
+                        start = time.time()
+                        try:
+                                rows = bcpCopy(table, fp, delimiter, schema, connection)
+                        except Exception as message:
+                                results[table] = (0, time.time() - start, message)
+                                return
+                        results[table] = (rows, time.time() - start, None)
+
+        for chain in chains:
+                try:
+                        connection = connect()
+                except Exception as message:
+                        for table, fp in chain:
+                                results[table] = (0, 0, message)
+                        continue
+                connections.append(connection)
+                thread = threading.Thread(target = loadChain, args = (chain, connection))
+                threads.append(thread)
+                thread.start()
+
+        for thread in threads:
+                thread.join()
+
+        return connections, results
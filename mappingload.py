@@ -14,8 +14,10 @@
 #
 # Assumes:
 #
-#	That no one else is adding Mapping or Accession IDs records to the 
-#       database.
+#	Other loads may add Mapping or Accession ID records at the same time:
+#	experiment and Accession keys are taken from their sequences and the
+#	MGI numbers are claimed in ACC_AccessionMax (see reserveExptKey,
+#	createAccessionBCP).
 #
 # Side Effects:
 #
@@ -40,9 +42,56 @@
 #	-D = database
 #	-U = user
 #	-P = password file
-#	-M = mode (incremental, full, preview)
+#	-M = mode (incremental, full, sync, preview, syncpreview)
 #	-I = input file of mapping data
+#	     gzip, bz2 or xz files are decompressed as they are read;
+#	     '-' reads the input from stdin
+#	     -I may be repeated, and may name a directory (every file in it,
+#	     in name order) to load several files in one run (batch mode);
+#	     each file has its own J: and experiments, the lookups, keys
+#	     and the bulk load at the end are shared
 #	-E = Experiment Type ("TEXT")
+#	--resume = resume the failed load of the last run (see resumeLoad):
+#	     the tables that were not loaded are loaded from the bcp files
+#	     of the run manifest, without validating the input again;
+#	     the other options must be the same as those of the failed run
+#	     (-I may be left out)
+#
+#	environment (see mappingload.config.default):
+#	MAPPINGSNAPSHOT = lookup snapshot file (optional); chromosome, assay
+#		and marker lookups are read from this local file; the Markers
+#		changed in the database are refreshed in it, and it is
+#		rebuilt when the chromosomes or assays have changed or
+#		Marker accession ids were deleted
+#	MAPPINGPREVIEWCACHE = preview cache file (optional); in preview mode,
+#		the marker lookups of records that are unchanged since the
+#		last preview run are reused (see resolveRecordMarkers);
+#		also used by fused mappingonlyload preview runs
+#	MAPPINGERRORLINES = number of line numbers listed per error in the
+#		error file summary
+#	MAPPINGERRORDETAIL = max number of lines in the error detail file
+#		(one line per error; 0 : no detail file)
+#	MAPPINGERRORBUDGET = stop once more than this number of records
+#		are invalid (0 : no limit)
+#	MAPPINGBULKTHRESHOLD = number of MLD_Expt_Marker rows above which
+#		the table is bulk loaded (see bcpFiles) (0 : never)
+#	MAPPINGBULKRATIO = bulk load only if the rows to load are at least
+#		this share of the rows of MLD_Expt_Marker (pg_class.reltuples)
+#	MAPPINGBULKTRIGGERS = comma-separated names of the MLD_Expt_Marker
+#		triggers to disable during a bulk load (default: none)
+#	MAPPINGSTAGINGSIZE = number of bytes of each bcp file kept in memory;
+#		beyond that the rows are staged in a local temporary file
+#		(TMPDIR)
+#	MAPPINGBCPSPILL = yes : also write the bcp rows to the *.mapping.bcp
+#		files (for auditing); the bcp files are always written
+#		in preview mode
+#	MAPPINGWORKERS = number of worker processes that validate the input
+#		(default 1 : validate in this process); see validateParallel
+#	MAPPINGWORKERCHUNK = number of input lines per worker task
+#	MAPPINGPIPELINE = yes : read the input, validate it and write the
+#		bcp rows in overlapping stages (see processRecords)
+#	MAPPINGPIPELINEQUEUE = max number of 1000-line batches waiting
+#		between two stages
 #
 #	processing modes:
 #	   incremental - append the data to existing Experiments (if they exist)
@@ -51,13 +100,27 @@
 #	   full - delete the data from existing Experiments (if they exist)
 #		    - create the Experiments if they don't exist
 #
+#	   sync - same result as full, but only the differences are written:
+#		    - the input records are matched with the existing
+#		      Experiment Marker records (by Experiment and Marker)
+#		    - new records are inserted, changed records updated
+#		      (Assay, sequence number, description) and records
+#		      no longer in the input deleted
+#		    - Experiments with no records left are deleted
+#		    - the existing Experiments keep their keys and tags
+#
+#	   syncpreview - sync, but report the number of inserts, updates
+#		      and deletes (diagnostics file) without loading
+#
 #     	   preview - perform all record verifications but do not load the data 
 #		      or make any changes to the database.  
 #		      Used for testing or to preview the load.
 #
 # Output:
 #
-#       4 BCP files:
+#       4 BCP files (staged in memory, or local temporary files beyond
+#       MAPPINGSTAGINGSIZE; loaded with "copy ... from stdin"; written
+#       to the *.mapping.bcp files if the load fails, for --resume):
 #
 #       ACC_Accession.bcp               Accession records
 #       MLD_Expts.bcp                   master Experiment records
@@ -68,13 +131,26 @@
 #		file of SQL commands for updating Marker chromosomes and bands
 #
 #	Diagnostics file of all input parameters and SQL commands
-#	Error file
+#	Error file: summary of the errors, by kind and offending value,
+#		with the number of lines and first line numbers of each
+#	Error detail file (mappingload.error.detail): one line per error,
+#		up to MAPPINGERRORDETAIL lines
+#	(--resume appends to the diagnostics, error and error detail
+#	files of the failed run)
+#	mappingload.manifest.json: run manifest of the load (see checkpoint):
+#		the input file and bcp file checksums, the keys and MGI
+#		numbers used, and which tables were loaded (for --resume)
+#	mappingload.metrics.json: wall time, SQL calls and rows fetched of
+#		each phase, lines/records processed, rows/bytes of each
+#		bcp file (for the job scheduler)
 #
 # Processing:
 #
 #	1. Verify Mode.
 #		if mode = incremental:  process records
 #		if mode = full:  delete existing records and process
+#		if mode = sync:  process, then apply the differences
+#		if mode = syncpreview:  process and report the differences
 #		if mode = preview:  set "DEBUG" to True
 #
 #	2. Verify the J: is valid.
@@ -118,43 +194,67 @@
 
 import sys
 import os
+import io
 import getopt
 import re
+import time
+import multiprocessing
 import db
 import mgi_utils
 import loadlib
+import mappinglib
 
 #globals
 
 DEBUG = 0		# set DEBUG to false unless preview mode is selected
+syncMode = 0		# set syncMode to true in sync/syncpreview mode
 
 inputFile = ''		# file descriptor
 diagFile = ''		# file descriptor
 errorFile = ''		# file descriptor
+errorDetailFile = None	# file descriptor
 
 exptFile = ''		# file descriptor
 exptMarkerFile = ''	# file descriptor
 accFile = ''		# file descriptor
 noteFile = ''		# file descriptor
 
+exptWriter = None	# mappinglib.BcpWriter of exptFile
+exptMarkerWriter = None	# mappinglib.BcpWriter of exptMarkerFile
+accWriter = None	# mappinglib.BcpWriter of accFile
+noteWriter = None	# mappinglib.BcpWriter of noteFile
+
 diagFileName = ''	# file name
+metricsFileName = ''	# file name
+manifestFileName = ''	# file name
 errorFileName = ''	# file name
 passwordFileName = ''	# file name
 
 inputFileName = ''	# file name
+inputFileNames = []	# file names (batch mode: more than one input file)
+inputChecksums = []	# [file name, sha1] of the input files read (see processFile)
 exptFileName = ''	# file name
 exptMarkerFileName = ''	# file name
 accFileName = ''	# file name
 noteFileName = ''	# file name
 
 mode = ''		# processing mode
+inputRecords = None	# records to process instead of the input file (see init)
+password = ''		# database password (for the bulk load connections)
+resume = 0		# --resume: resume the failed load of the run manifest
+manifest = None		# run manifest of the load (see checkpoint)
 
-markerDict = {}		# dictionary of marker accids and marker keys/symbols
+markerDict = {}		# dictionary of marker accid / (marker key, marker symbol)
+markerChecked = set()	# set of marker accids already looked up
 chromosomeList = []	# list of valid mouse chromosome
-inputChrList = []	# list of unique chromosomes from input file
 exptDict = {}		# dictionary of chromosome/experiment key values
+referenceState = {}	# dictionary of Reference key / [exptDict, seqExptDict, exptTag]
 seqExptDict = {}	# dictionary of experiment marker sequence values
 assayDict = {}		# dictionary of Assay Types
+referenceCache = {}	# dictionary of J: / (Reference key, error text)
+userCache = {}		# dictionary of user login / (User key, error text)
+cacheHits = {}		# dictionary of cache name / number of cache hits
+cacheMisses = {}	# dictionary of cache name / number of cache misses
 
 logicalDBKey = 1
 mgiTypeKey = 4          # Experiment
@@ -167,14 +267,68 @@ createdByKey = 1000	# Created By Key
 alleleKey = ''		# MLD_Expt_Marker._Allele_key
 matrixData = 0		# MLD_Extt_Marker.matrixData
 
-exptKey = 0
-accKey = 0
-mgiKey = 0
+nextExptKey = 0		# preview: next experiment key (see reserveExptKey)
+
+# sync mode (see loadSyncRows, syncRecord, applySync)
+syncExpts = set()	# existing experiment keys of the References
+syncUsed = set()	# experiment keys with input records
+syncRows = {}		# (experiment key, Marker key) / list of existing
+			# [_Assoc_key, _Expt_key, _Marker_key, _Assay_Type_key,
+			#  sequenceNum, description] not matched yet
+syncKeys = {}		# _Assoc_key / existing record not matched yet
+syncMatched = {}	# _Assoc_key / (existing record, input record, counter)
+			# of the records matched by Experiment and Marker
+syncUpdates = {}	# _Assoc_key / existing record to update
+syncMoved = []		# existing records moved to a new Experiment
+syncCounts = {'inserted' : 0, 'updated' : 0, 'unchanged' : 0, 'deleted' : 0}
+accessions = []		# experiment keys of the new experiments (see createAccessionBCP)
+accessionKeys = []	# (experiment key, Accession key) of the new experiments
+mgiFirst = 0		# first MGI number claimed (see createAccessionBCP)
+fullDeletes = []	# full mode: experiment keys deleted (run manifest)
+maxMappingKey = 0	# highest MLD_Expt_Marker key in the input
 exptTag = 1
 exptCount = 0
 
 loaddate = loadlib.loaddate	# current date
 
+bcpSpill = os.getenv('MAPPINGBCPSPILL', 'no') == 'yes'	# write bcp files?
+
+# error reporting (see mappinglib.ErrorCollector)
+errorCollector = None
+errorLineLimit = int(os.getenv('MAPPINGERRORLINES', '10'))
+errorDetailLimit = int(os.getenv('MAPPINGERRORDETAIL', '10000'))
+errorBudget = int(os.getenv('MAPPINGERRORBUDGET', '0'))
+invalidRecords = 0	# number of invalid records so far
+stagingSize = int(os.getenv('MAPPINGSTAGINGSIZE', '67108864'))	# bytes in memory per bcp file
+
+# parallel validation (see validateParallel)
+validateWorkers = int(os.getenv('MAPPINGWORKERS', '1'))
+validateChunkSize = int(os.getenv('MAPPINGWORKERCHUNK', '10000'))
+
+# pipelined processing (see processRecords)
+pipeline = os.getenv('MAPPINGPIPELINE', 'no') == 'yes'
+pipelineQueueSize = int(os.getenv('MAPPINGPIPELINEQUEUE', '8'))
+
+# lookup snapshot file (optional, see mappinglib.openSnapshot)
+snapshotFileName = os.getenv('MAPPINGSNAPSHOT', '')
+snapshot = None		# sqlite3 connection to the lookup snapshot
+
+# preview cache file (optional, see loadRecordMarkers)
+previewCacheFileName = os.getenv('MAPPINGPREVIEWCACHE', '')
+previewCache = None	# record hash / marker lookup of the last preview run
+previewLines = {}	# record hash / marker lookup of this run
+previewStamp = ''	# validation stamp of the lookups
+
+# bulk load (see bcpFiles): table / names of its triggers to disable,
+# row threshold and share of the rows of the table a load must reach
+# (ACC_Accession only gets one row per Experiment)
+bulkTables = {'MLD_Expt_Marker' : [name for name in str.split(os.getenv('MAPPINGBULKTRIGGERS', ''), ',') if name != '']}
+bulkThreshold = int(os.getenv('MAPPINGBULKTHRESHOLD', '100000'))
+bulkRatio = float(os.getenv('MAPPINGBULKRATIO', '0.2'))
+
+# bcp load dependencies: table / table that must be loaded first
+bcpDepends = {'MLD_Expt_Marker' : 'MLD_Expts'}
+
 def showUsage():
         '''
         # requires:
@@ -192,7 +346,8 @@ def showUsage():
                 '-P password file\n' + \
                 '-M mode\n' + \
                 '-I input file\n' + \
-                '-E Experiment Type (ex. "TEXT", "TEXT-Physical Mapping")\n'
+                '-E Experiment Type (ex. "TEXT", "TEXT-Physical Mapping")\n' + \
+                '[--resume]\n'
         exit(1, usage)
  
 def exit(status, message = None):
@@ -210,8 +365,21 @@ def exit(status, message = None):
         if message is not None:
                 sys.stderr.write('\n' + str(message) + '\n')
  
+        if metricsFileName != '':
+                try:
+                        mappinglib.writeMetrics(metricsFileName, status)
+                except:
+                        pass
+
         try:
                 inputFile.close()
+                errorCollector.summary(errorFile)
+                if errorDetailFile is not None:
+                        errorDetailFile.close()
+        except:
+                pass
+
+        try:
                 diagFile.write('\n\nEnd Date/Time: %s\n' % (mgi_utils.date()))
                 errorFile.write('\n\nEnd Date/Time: %s\n' % (mgi_utils.date()))
                 diagFile.close()
@@ -222,9 +390,13 @@ def exit(status, message = None):
         db.useOneConnection()
         sys.exit(status)
  
-def init():
+def init(argv = None, records = None):
         '''
         # requires: 
+        #	argv - command line options (default: sys.argv[1:])
+        #	records - iterable of (lineNum, tokens, line) to process
+        #		instead of the -I input file (see readInput);
+        #		used by mappingonlyload (MAPPINGFUSED)
         #
         # effects: 
         # 1. Processes command line options
@@ -237,13 +409,19 @@ def init():
         '''
  
         global inputFile, diagFile, errorFile, errorFileName, diagFileName
-        global passwordFileName, noteFileName
+        global errorDetailFile, errorCollector
+        global passwordFileName, noteFileName, password, metricsFileName
+        global manifestFileName, resume
         global exptFile, exptMarkerFile, accFile, noteFile
+        global exptWriter, exptMarkerWriter, accWriter, noteWriter
         global inputFileName, exptFileName, exptMarkerFileName, accFileName
-        global mode, exptType
+        global mode, exptType, inputRecords, inputFileNames
  
+        if argv is None:
+            argv = sys.argv[1:]
+
         try:
-            optlist, args = getopt.getopt(sys.argv[1:], 'S:D:U:P:M:I:R:E:C:')
+            optlist, args = getopt.getopt(argv, 'S:D:U:P:M:I:R:E:C:', ['resume'])
         except:
             showUsage()
  
@@ -273,8 +451,16 @@ def init():
                 mode = opt[1]
             elif opt[0] == '-I':
                 inputFileName = opt[1]
+                if os.path.isdir(inputFileName):
+                    for fileName in sorted(os.listdir(inputFileName)):
+                        if os.path.isfile(os.path.join(inputFileName, fileName)):
+                            inputFileNames.append(os.path.join(inputFileName, fileName))
+                else:
+                    inputFileNames.append(inputFileName)
             elif opt[0] == '-E':
                 exptType = re.sub('"', '', opt[1])
+            elif opt[0] == '--resume':
+                resume = 1
             else:
                 showUsage()
 
@@ -285,7 +471,7 @@ def init():
            user == '' or \
            password == '' or \
            mode == '' or \
-           inputFileName == '' or \
+           (len(inputFileNames) == 0 and records is None and not resume) or \
            exptType == '':
                 showUsage()
 
@@ -294,47 +480,86 @@ def init():
         db.useOneConnection(1)
  
         diagFileName = 'mappingload.diag'
+        metricsFileName = 'mappingload.metrics.json'
+        manifestFileName = 'mappingload.manifest.json'
         errorFileName = 'mappingload.error'
         exptFileName = 'MLD_Expts.mapping.bcp'
         exptMarkerFileName = 'MLD_Expt_Marker.mapping.bcp'
         accFileName = 'ACC_Accession.mapping.bcp'
         noteFileName = 'MLD_Notes.mapping.bcp'
 
-        try:
-            inputFile = open(inputFileName, 'r')
-        except:
-            exit(1, 'Could not open file %s\n' % inputFileName)
+        if records is not None:
+            inputRecords = records
+            inputFile = io.StringIO()
+            inputFileName = '(mappingonlyload)'
+        else:
+            for inputFileName in inputFileNames:
+                if inputFileName == '-':
+                    continue
+                try:
+                    inputFile = open(inputFileName, 'r')
+                except:
+                    exit(1, 'Could not open file %s\n' % inputFileName)
+                inputFile.close()
+            inputFileName = ', '.join(inputFileNames)
                 
+        # --resume: keep the diagnostics and errors of the failed run
+        if resume:
+            logMode = 'a'
+        else:
+            logMode = 'w'
+
         try:
-            diagFile = open(diagFileName, 'w')
+            diagFile = open(diagFileName, logMode)
         except:
             exit(1, 'Could not open file %s\n' % diagFileName)
                 
         try:
-            errorFile = open(errorFileName, 'w')
+            errorFile = open(errorFileName, logMode)
         except:
             exit(1, 'Could not open file %s\n' % errorFileName)
+
+        if errorDetailLimit > 0:
+            try:
+                errorDetailFile = open(errorFileName + '.detail', logMode)
+            except:
+                exit(1, 'Could not open file %s\n' % (errorFileName + '.detail'))
+
+        errorCollector = mappinglib.ErrorCollector(errorDetailFile, errorDetailLimit, errorLineLimit)
                 
-        try:
-            exptFile = open(exptFileName, 'w')
-        except:
-            exit(1, 'Could not open file %s\n' % exptFileName)
-                
-        try:
-            exptMarkerFile = open(exptMarkerFileName, 'w')
-        except:
-            exit(1, 'Could not open file %s\n' % exptMarkerFileName)
-                
-        try:
-            accFile = open(accFileName, 'w')
-        except:
-            exit(1, 'Could not open file %s\n' % accFileName)
-                
-        try:
-            noteFile = open(noteFileName, 'w')
-        except:
-            exit(1, 'Could not open file %s\n' % noteFileName)
-                
+        # bcp rows are staged in memory (local temporary files beyond
+        # stagingSize) and streamed to the database
+        exptFile = mappinglib.stagingFile(stagingSize)
+        exptMarkerFile = mappinglib.stagingFile(stagingSize)
+        accFile = mappinglib.stagingFile(stagingSize)
+        noteFile = mappinglib.stagingFile(stagingSize)
+
+        # one row writer per bcp file; the columns that are the same on
+        # every row are formatted once
+        exptWriter = mappinglib.BcpWriter(exptFile, \
+                ['_Expt_key', '_Refs_key', 'exptType', 'tag', 'chromosome', \
+                 'creation_date', 'modification_date'], \
+                {'exptType' : exptType, 'creation_date' : loaddate, 'modification_date' : loaddate}, \
+                ['chromosome'], bcpdelim)
+        exptMarkerWriter = mappinglib.BcpWriter(exptMarkerFile, \
+                ['_Assoc_key', '_Expt_key', '_Marker_key', '_Allele_key', '_Assay_Type_key', \
+                 'sequenceNum', 'description', 'matrixData', 'creation_date', 'modification_date'], \
+                {'_Allele_key' : alleleKey, 'matrixData' : matrixData, \
+                 'creation_date' : loaddate, 'modification_date' : loaddate}, \
+                ['description'], bcpdelim)
+        accWriter = mappinglib.BcpWriter(accFile, \
+                ['_Accession_key', 'accID', 'prefixPart', 'numericPart', '_LogicalDB_key', \
+                 '_Object_key', '_MGIType_key', 'private', 'preferred', \
+                 '_CreatedBy_key', '_ModifiedBy_key', 'creation_date', 'modification_date'], \
+                {'prefixPart' : mgiPrefix, '_LogicalDB_key' : logicalDBKey, '_MGIType_key' : mgiTypeKey, \
+                 'private' : 0, 'preferred' : 1, '_CreatedBy_key' : createdByKey, \
+                 '_ModifiedBy_key' : createdByKey, 'creation_date' : loaddate, 'modification_date' : loaddate}, \
+                (), bcpdelim)
+        noteWriter = mappinglib.BcpWriter(noteFile, \
+                ['_Refs_key', 'note', 'creation_date', 'modification_date'], \
+                {'creation_date' : loaddate, 'modification_date' : loaddate}, \
+                ['note'], bcpdelim)
+
         # Log all SQL
         db.set_sqlLogFunction(db.sqlLogAll)
 
@@ -364,10 +589,15 @@ def verifyMode():
         #
         '''
 
-        global DEBUG
+        global DEBUG, syncMode
 
         if mode == 'preview':
             DEBUG = 1
+        elif mode == 'syncpreview':
+            DEBUG = 1
+            syncMode = 1
+        elif mode == 'sync':
+            syncMode = 1
         elif mode not in ['incremental', 'full']:
             exit(1, 'Invalid Processing Mode:  %s\n' % (mode))
 
@@ -400,7 +630,7 @@ def verifyChromosome(chromosome, lineNum):
         # effects:
         #	verifies that:
         #		the Chromosome is valid
-        #	writes to the error file if the Chromosome is invalid
+        #	reports the error if the Chromosome is invalid
         #
         # returns:
         #	0 if the Chromosome is invalid
@@ -413,7 +643,8 @@ def verifyChromosome(chromosome, lineNum):
         if chromosome in chromosomeList:
             return 1
         else:
-            errorFile.write('Invalid Chromosome (%d) %s\n' % (lineNum, chromosome))
+            errorCollector.add('Invalid Chromosome', chromosome, lineNum, \
+                'Invalid Chromosome (%d) %s\n' % (lineNum, chromosome))
             return 0
 
 def verifyMarker(markerID, lineNum):
@@ -424,10 +655,10 @@ def verifyMarker(markerID, lineNum):
         #
         # effects:
         #    verifies that:
-        #    the Marker exists either in the marker dictionary or the database
+        #    the Marker exists in the marker dictionary
+        #    (see resolveInput/loadMarkers; the marker id has already been
+        #    resolved against the database)
         #    writes to the error file if the Marker is invalid
-        #    adds the marker id and key to the marker dictionary 
-        #        *if the Marker is valid)
         #
         # returns:
         #	0 and '' if the Marker is invalid
@@ -435,87 +666,273 @@ def verifyMarker(markerID, lineNum):
         #
         '''
 
+        if markerID in markerDict:
+                return markerDict[markerID]
+
+        errorCollector.add('Invalid Mouse Marker', markerID, lineNum, \
+                'Invalid Mouse Marker (%d) %s\n' % (lineNum, markerID))
+        return(0, '')
+
+def verifyCached(cacheName, cache, verify, value, lineNum):
+        '''
+        # requires:
+        #	cacheName - name of the cache (for the diagnostics file)
+        #	cache - dictionary of value / (key, error text)
+        #	verify - loadlib verification function
+        #		(ex. loadlib.verifyReference, loadlib.verifyUser)
+        #	value - the value to verify
+        #	lineNum - the line number of the record from the input file
+        #
+        # effects:
+        #	calls verify() once per distinct value and caches its result
+        #	along with any error text it writes, so that an invalid value
+        #	is still reported on every line
+        #	records cache hits/misses
+        #
+        # returns:
+        #	the key returned by verify() (0 if invalid)
+        #
+        '''
+
+        if value in cache:
+                cacheHits[cacheName] = cacheHits.get(cacheName, 0) + 1
+                key, errors = cache[value]
+        else:
+                key, errors = fillCache(cacheName, cache, verify, value, 0)
+
+        if errors != '':
+                errorCollector.add('Invalid %s' % (cacheName), value, lineNum, errors)
+
+        return key
+
+def fillCache(cacheName, cache, verify, value, lineNum):
+        '''
+        # requires:
+        #	see verifyCached; value is not in cache
+        #
+        # effects:
+        #	calls verify() and caches its result along with any error text
+        #	records the cache miss
+        #
+        # returns:
+        #	the key returned by verify() (0 if invalid) and the error text
+        #
+        '''
+
+        cacheMisses[cacheName] = cacheMisses.get(cacheName, 0) + 1
+        errors = io.StringIO()
+        key = verify(value, lineNum, errors)
+        errors = errors.getvalue()
+        cache[value] = (key, errors)
+        diagFile.write('%s cache miss: %s\n' % (cacheName, value))
+
+        return key, errors
+
+def verifyReference(jnum, lineNum):
+        '''
+        # requires:
+        #	jnum - the J: of the Reference
+        #	lineNum - the line number of the record from the input file
+        #
+        # effects:
+        #	cached loadlib.verifyReference
+        #
+        # returns:
+        #	Reference key (0 if invalid)
+        #
+        '''
+
+        return verifyCached('Reference', referenceCache, loadlib.verifyReference, jnum, lineNum)
+
+def verifyUser(createdBy, lineNum):
+        '''
+        # requires:
+        #	createdBy - the login of the User
+        #	lineNum - the line number of the record from the input file
+        #
+        # effects:
+        #	cached loadlib.verifyUser
+        #
+        # returns:
+        #	User key (0 if invalid)
+        #
+        '''
+
+        return verifyCached('User', userCache, loadlib.verifyUser, createdBy, lineNum)
+
+def loadMarkers(markerIDs, markers = None):
+        '''
+        # requires:
+        #	markerIDs - set of unique Marker Accession IDs from the input file
+        #	markers - dictionary of accession id : (Marker key, Marker symbol)
+        #		already resolved for markerIDs by the caller (optional)
+        #
+        # effects:
+        #	resolves the marker ids that have not been looked up yet
+        #	in batches (mappinglib.resolveMarkers, or the lookup snapshot)
+        #	unless markers is given, and loads global markerDict
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
         global markerDict
 
-        markerKey = None
+        markerIDs = markerIDs - markerChecked
+        markerChecked.update(markerIDs)
 
-        if markerID in markerDict:
-                [markerKey, markerSymbol] = str.split(markerDict[markerID], ':')
-                return(markerKey, markerSymbol)
+        if markers is not None:
+                pass
+        elif snapshot is not None:
+                markers = mappinglib.snapshotMarkers(snapshot, markerIDs)
         else:
-                results = db.sql('''select m._Marker_key, m.symbol 
-                        from MRK_Marker m, MRK_Acc_View a 
-                        where a.accID = '%s' 
-                        and a._Object_key = m._Marker_key 
-                        and m._Organism_key = 1'''  % (markerID), 'auto')
-                for r in results:
-                        markerKey = r['_Marker_key']
-                        markerSymbol = r['symbol']
-
-                if markerKey is None:
-                        errorFile.write('Invalid Mouse Marker (%d) %s\n' % (lineNum, markerID))
-                        markerKey = 0
-                        markerSymbol = ''
-                else:
-                        markerDict[markerID] = repr(markerKey) + ':' + markerSymbol
+                markers = mappinglib.resolveMarkers(markerIDs)
 
-        return(markerKey, markerSymbol)
+        markerDict.update(markers)
 
-def loadDictionaries():
+def recordMarkers(records, hashing):
+        '''
+        # requires:
+        #	records - list of (lineNum, tokens, line) (see readInput)
+        #	hashing - 1 if the records are hashed (preview cache)
+        #
+        # returns:
+        #	the set of the marker ids of the records and
+        #	the (record hash, marker id) of each record, or None
+        #	if not hashing (see resolveRecordMarkers)
+        #
+        '''
+
+        markerIDs = set([tokens[1] for lineNum, tokens, line in records if tokens is not None])
+        hashes = None
+
+        if hashing:
+                hashes = [(mappinglib.lineHash(tokens[1:]), tokens[1]) for lineNum, tokens, line in records \
+                        if tokens is not None]
+
+        return markerIDs, hashes
+
+def loadRecordMarkers(records):
         '''
         # requires:
+        #	records - list of (lineNum, tokens, line) (see readInput)
         #
         # effects:
-        #	loads global dictionaries/lists: chromosomeList for lookup
+        #	resolves the marker ids of the records (resolveRecordMarkers)
         #
         # returns:
         #	nothing
+        #
         '''
 
-        global chromosomeList, assayDict, inputChrList
+        markerIDs, hashes = recordMarkers(records, previewCache is not None)
+        resolveRecordMarkers(markerIDs, hashes)
 
-        results = db.sql('''select chromosome from MRK_Chromosome 
-                where _Organism_key = 1 
-                and chromosome not in ('UN') 
-                order by sequenceNum''', 'auto')
-        for r in results:
-                chromosomeList.append(r['chromosome'])
+def resolveRecordMarkers(markerIDs, hashes):
+        '''
+        # requires:
+        #	markerIDs - set of the marker ids of the records
+        #	hashes - list of (record hash, marker id) of each record
+        #		(see recordMarkers), or None without a preview cache
+        #
+        # effects:
+        #	resolves the marker ids of the records (loadMarkers)
+        #	in preview mode with a preview cache, the records that
+        #	are unchanged since the last preview run take their marker
+        #	lookup from the cache; only the new or changed records are
+        #	checked against the database (or snapshot).  the lookups of
+        #	this run are kept for the next one (see savePreviewCache)
+        #
+        # returns:
+        #	nothing
+        #
+        '''
 
-        results = db.sql('select * from MLD_Assay_Types', 'auto')
-        for r in results:
-                assayDict[r['description']] = r['_Assay_Type_key']
+        if previewCache is not None:
+                cachedIDs, cached, hits = mappinglib.cachedMarkers(previewCache, hashes)
+                mappinglib.addCounter('previewCache.hits', hits)
+                mappinglib.addCounter('previewCache.misses', len(hashes) - hits)
+                loadMarkers(cachedIDs, cached)
+
+        loadMarkers(markerIDs)
+
+        if previewCache is not None:
+                for recordHash, markerID in hashes:
+                        previewLines[recordHash] = markerDict.get(markerID)
+
+def savePreviewCache():
+        '''
+        # requires:
+        #
+        # effects:
+        #	writes the marker lookups of this preview run to the
+        #	preview cache file (see loadRecordMarkers)
+        #
+        # returns:
+        #	nothing
+        #
+        '''
 
-        # create unique list of chromosomes from input file
-        for line in inputFile.readlines():
-            tokens = str.split(line[:-1], '|')
-            chromosome = tokens[1]
-            if chromosome not in inputChrList:
-                inputChrList.append(chromosome)
-        inputFile.close()
+        if previewCache is not None:
+                mappinglib.writePreviewCache(previewCacheFileName, previewStamp, previewLines)
 
-def getPrimaryKeys():
+def loadDictionaries():
         '''
         # requires:
         #
         # effects:
-        #	get/store next primary keys
+        #	loads global dictionaries/lists: chromosomeList for lookup
+        #	from the lookup snapshot, if MAPPINGSNAPSHOT is set
         #
         # returns:
         #	nothing
+        '''
+
+        global chromosomeList, assayDict, snapshot
+        global previewCache, previewStamp
+
+        if snapshotFileName != '':
+                snapshot = mappinglib.openSnapshot(snapshotFileName)
+                chromosomeList = mappinglib.snapshotChromosomes(snapshot)
+                assayDict = mappinglib.snapshotAssays(snapshot)
+                diagFile.write('Lookup Snapshot: %s\n' % (snapshotFileName))
+        else:
+                chromosomeList = mappinglib.loadChromosomes()
+                assayDict = mappinglib.loadAssays()
+
+        if DEBUG and previewCacheFileName != '':
+                previewStamp = mappinglib.previewStamp(snapshot)
+                previewCache = mappinglib.openPreviewCache(previewCacheFileName, previewStamp)
+                diagFile.write('Preview Cache: %s (%d records)\n' % (previewCacheFileName, len(previewCache)))
+
+def reserveExptKey():
+        '''
+        # requires:
+        #
+        # effects:
+        #	reserves the key of a new experiment from mld_expts_seq,
+        #	as each new chromosome is found: the load takes as many keys
+        #	as the input has experiments.
+        #	preview: the keys are counted on from the next value of
+        #	mld_expts_seq, which is not advanced
+        #
+        # returns:
+        #	the experiment key
         #
         '''
 
-        global exptKey, accKey, mgiKey
+        global nextExptKey
 
-        results = db.sql(''' select nextval('mld_expts_seq') as maxKey ''', 'auto')
-        exptKey = results[0]['maxKey']
+        if not DEBUG:
+                return mappinglib.reserveKeys('mld_expts_seq', 1)[0]
 
-        results = db.sql('''select max(_Accession_key) + 1  as maxKey from ACC_Accession''', 'auto')
-        accKey = results[0]['maxKey']
+        if nextExptKey == 0:
+                nextExptKey = mappinglib.reserveKeys('mld_expts_seq', 1, claim = 0)[0]
+
+        nextExptKey = nextExptKey + 1
+        return nextExptKey - 1
 
-        results = db.sql('''select maxNumericPart + 1 as maxKey from ACC_AccessionMax where prefixPart = '%s' ''' % (mgiPrefix), 'auto')
-        mgiKey = results[0]['maxKey']
-        
 def createExperimentMaster():
         '''
         # requires:
@@ -535,10 +952,15 @@ def createExperimentMaster():
         global exptDict, seqExptDict
         global exptTag
 
-        results = db.sql('''select _Expt_key, chromosome, tag 
-                from MLD_Expts 
-                where _Refs_key = %d 
-                order by tag''' % (referenceKey), 'auto')
+        # existing experiments of the reference and the next sequenceNum
+        # of each experiment, in one round trip
+        results = db.sql('''select e._Expt_key, e.chromosome, e.tag,
+                coalesce(max(m.sequenceNum), 0) + 1 as nextSeq
+                from MLD_Expts e
+                left outer join MLD_Expt_Marker m on (e._Expt_key = m._Expt_key)
+                where e._Refs_key = %d 
+                group by e._Expt_key, e.chromosome, e.tag
+                order by e.tag''' % (referenceKey), 'auto')
 
         # experiment records exists
 
@@ -546,37 +968,256 @@ def createExperimentMaster():
 
                 # if 'full', then delete existing MLD_Expt_Marker records
                 if mode == 'full':
+                        fullDeletes.extend([r['_Expt_key'] for r in results])
+
                         # delete the existing *details*.....
                         #db.sql('delete MLD_Expt_Marker from MLD_Expt_Marker m, MLD_Expts e ' + \
                         #        ' where e._Refs_key = %d and e._Expt_key = m._Expt_key ' % (referenceKey), \
                         #        'auto', execute = not DEBUG)
-                        db.sql('''select e._expt_key 
-                            into temporary table toDelete
-                            from MLD_Expts e
-                            where e._Refs_key = %d''' % (referenceKey), None) 
-                        
-                        db.sql('''create index idx1 on toDelete(_expt_key)''')
-                        db.sql('''delete from MLD_Expts e
-                            using toDelete d
-                            where e._expt_key = d._expt_key''', None, execute = not DEBUG)
-
-                # set seqExptDict to save the next max(sequenceNum) for each _Expt_key/chromosome
+                        # (once per Reference: batch mode may delete several)
+                        db.sql('''delete from MLD_Expts
+                            where _Refs_key = %d''' % (referenceKey), None, execute = not DEBUG)
+
+                # set seqExptDict to save the next sequenceNum for each _Expt_key/chromosome
+                # and exptTag to the next tag of the reference
+                # (sync: the records are renumbered from 1, as in full mode)
                 else:
                     for r in results:
                         exptDict[r['chromosome']] = r['_Expt_key']
-                        s = db.sql('''select max(sequencenum) as maxKey from MLD_Expt_Marker where _Expt_key = %d''' % (r['_Expt_key']), 'auto')
-                        if len(s) == 0:
-                          seqExptDict[r['_Expt_key']] = 1
+                        if syncMode:
+                            seqExptDict[r['_Expt_key']] = 1
                         else:
-                          seqExptDict[r['_Expt_key']] = s[0]['maxKey']
+                            seqExptDict[r['_Expt_key']] = r['nextSeq']
+
+                    exptTag = results[-1]['tag'] + 1
+
+                    if syncMode:
+                        loadSyncRows()
+
+        # the experiments themselves are created by processFile
+        # as each new chromosome is found in the input file
+
+def loadSyncRows():
+        '''
+        # requires:
+        #
+        # effects:
+        #	sync mode: loads the existing Experiments and Experiment
+        #	Marker records of the Reference (syncExpts, syncRows)
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        results = db.sql('''select m._Assoc_key, m._Expt_key, m._Marker_key,
+                m._Assay_Type_key, m.sequenceNum, m.description
+                from MLD_Expts e, MLD_Expt_Marker m
+                where e._Refs_key = %d
+                and e._Expt_key = m._Expt_key
+                order by m._Expt_key, m.sequenceNum''' % (referenceKey), 'auto')
+
+        syncExpts.update(exptDict.values())
+
+        for r in results:
+                entry = [r['_Assoc_key'], r['_Expt_key'], str(r['_Marker_key']), \
+                        r['_Assay_Type_key'], r['sequenceNum'], r['description'] or '']
+                syncRows.setdefault((r['_Expt_key'], str(r['_Marker_key'])), []).append(entry)
+                syncKeys[r['_Assoc_key']] = entry
+
+def syncMatch(entry, exptKey, markerKey, assayKey, sequenceNum, description):
+        '''
+        # requires:
+        #	entry - the existing record (see syncRows)
+        #	exptKey, markerKey, assayKey, sequenceNum, description -
+        #		the input record
+        #
+        # effects:
+        #	sync mode: removes the existing record from the records
+        #	not matched yet, and stages its update (syncUpdates)
+        #	if it differs from the input record
+        #
+        # returns:
+        #	the counter of the match: 'unchanged' or 'updated'
+        #
+        '''
+
+        assocKey = entry[0]
+        del syncKeys[assocKey]
+        syncRows[(entry[1], entry[2])].remove(entry)
+
+        record = [exptKey, str(markerKey), assayKey, sequenceNum, description]
+
+        if entry[1:] == record:
+                count = 'unchanged'
+        else:
+                syncUpdates[assocKey] = [assocKey] + record
+                count = 'updated'
+
+        syncCounts[count] = syncCounts[count] + 1
+        return count
 
-                        exptTag = r['tag'] + 1
+def syncRecord(mappingKey, exptKey, markerKey, assayKey, description):
+        '''
+        # requires:
+        #	mappingKey - MLD_Expt_Marker key of the input record
+        #	exptKey - the experiment key of the record
+        #	markerKey, assayKey, description - the record
+        #
+        # effects:
+        #	sync mode: matches the input record with the existing
+        #	record of the same key (a rerun of the same input file),
+        #	else with the next existing record of the same Experiment
+        #	and Marker (syncRows):
+        #	writes the bcp entry if there is none,
+        #	stages the update (syncUpdates) if it differs;
+        #	a record of the same key moved to a new Experiment is
+        #	deleted (syncMoved) and written to the bcp file.
+        #	an existing record matched by Experiment and Marker whose
+        #	key then shows up in the input is given to that input
+        #	record; the earlier input record is inserted instead.
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        sequenceNum = seqExptDict[exptKey]
+        syncUsed.add(exptKey)
 
-        # now create experiments
+        if str.isdigit(mappingKey):
+                assocKey = int(mappingKey)
+        else:
+                assocKey = None
+
+        if assocKey in syncMatched:
+                entry, record, count = syncMatched.pop(assocKey)
+                syncUpdates.pop(assocKey, None)
+                exptMarkerWriter.write(*record)
+                syncCounts[count] = syncCounts[count] - 1
+                syncCounts['inserted'] = syncCounts['inserted'] + 1
+                syncRows.setdefault((entry[1], entry[2]), []).append(entry)
+                syncKeys[assocKey] = entry
+
+        if assocKey in syncKeys and exptKey in syncExpts:
+                syncMatch(syncKeys[assocKey], exptKey, markerKey, assayKey, sequenceNum, description)
+                return
+
+        # the record moves to an Experiment created by this load: it is
+        # deleted, and loaded again with its key once the delete is
+        # committed (see bcpFiles)
+        if assocKey in syncKeys:
+                entry = syncKeys.pop(assocKey)
+                syncRows[(entry[1], entry[2])].remove(entry)
+                syncMoved.append(entry)
+                exptMarkerWriter.write(mappingKey, exptKey, markerKey, assayKey, sequenceNum, description)
+                syncCounts['updated'] = syncCounts['updated'] + 1
+                return
+
+        existing = syncRows.get((exptKey, str(markerKey)), [])
+
+        if len(existing) == 0:
+                exptMarkerWriter.write(mappingKey, exptKey, markerKey, assayKey, sequenceNum, description)
+                syncCounts['inserted'] = syncCounts['inserted'] + 1
+                return
+
+        entry = existing[0]
+        count = syncMatch(entry, exptKey, markerKey, assayKey, sequenceNum, description)
+        syncMatched[entry[0]] = (entry, [mappingKey, exptKey, markerKey, assayKey, sequenceNum, description], count)
+
+def applySync():
+        '''
+        # requires:
+        #
+        # effects:
+        #	sync mode: deletes the existing records that were not matched
+        #	by an input record and the existing Experiments with no
+        #	input records, and applies the staged updates, each with one
+        #	set-based statement (not in syncpreview mode)
+        #	reports the number of inserts, updates and deletes
+        #	the changes are committed before the load (see bcpFiles)
+        #
+        # returns:
+        #	nothing
+        #
+        '''
 
-        for c in chromosomeList:
-                if c in inputChrList:
-                    createExperimentBCP(c)
+        deleteFile = io.StringIO()
+        exptDeleteFile = io.StringIO()
+        updateFile = io.StringIO()
+        deleteWriter = mappinglib.BcpWriter(deleteFile, ['_Assoc_key'], delimiter = bcpdelim)
+        exptDeleteWriter = mappinglib.BcpWriter(exptDeleteFile, ['_Expt_key'], delimiter = bcpdelim)
+        updateWriter = mappinglib.BcpWriter(updateFile, \
+                ['_Assoc_key', '_Expt_key', '_Marker_key', '_Assay_Type_key', 'sequenceNum', 'description'], \
+                text = ['description'], delimiter = bcpdelim)
+
+        exptDeletes = syncExpts - syncUsed
+
+        for exptKey, markerKey in syncRows:
+                for entry in syncRows[(exptKey, markerKey)]:
+                        syncCounts['deleted'] = syncCounts['deleted'] + 1
+                        if exptKey not in exptDeletes:
+                                deleteWriter.write(entry[0])
+
+        for entry in syncMoved:
+                if entry[1] not in exptDeletes:
+                        deleteWriter.write(entry[0])
+
+        for exptKey in sorted(exptDeletes):
+                exptDeleteWriter.write(exptKey)
+
+        for assocKey in sorted(syncUpdates):
+                updateWriter.write(*syncUpdates[assocKey])
+
+        deleteWriter.flush()
+        exptDeleteWriter.flush()
+        updateWriter.flush()
+
+        for name in ('inserted', 'updated', 'unchanged', 'deleted'):
+                mappinglib.setCounter('sync.' + name, syncCounts[name])
+        mappinglib.setCounter('sync.exptDeleted', len(exptDeletes))
+
+        diagFile.write('sync: MLD_Expt_Marker: %d inserted, %d updated, %d unchanged, %d deleted\n' % \
+                (syncCounts['inserted'], syncCounts['updated'], syncCounts['unchanged'], syncCounts['deleted']))
+        diagFile.write('sync: MLD_Expts: %d inserted, %d deleted\n' % (exptCount, len(exptDeletes)))
+
+        if DEBUG:
+                return
+
+        # the updates first: a record may move out of an Experiment
+        # that is deleted
+        if len(syncUpdates) > 0:
+                db.sql('''create temporary table syncUpdate (
+                        _Assoc_key int not null,
+                        _Expt_key int not null,
+                        _Marker_key int not null,
+                        _Assay_Type_key int not null,
+                        sequenceNum int not null,
+                        description text null)''', None)
+                mappinglib.bcpCopy('syncUpdate', updateFile, bcpdelim, 'pg_temp')
+                db.sql('''update MLD_Expt_Marker m
+                        set _Expt_key = u._Expt_key,
+                        _Marker_key = u._Marker_key,
+                        _Assay_Type_key = u._Assay_Type_key,
+                        sequenceNum = u.sequenceNum,
+                        description = u.description,
+                        modification_date = now()
+                        from syncUpdate u
+                        where m._Assoc_key = u._Assoc_key''', None)
+
+        if len(exptDeletes) > 0:
+                db.sql('''create temporary table syncExptDelete (_Expt_key int not null)''', None)
+                mappinglib.bcpCopy('syncExptDelete', exptDeleteFile, bcpdelim, 'pg_temp')
+                db.sql('''delete from MLD_Expts e
+                    using syncExptDelete d
+                    where e._Expt_key = d._Expt_key''', None)
+
+        if deleteWriter.rows > 0:
+                db.sql('''create temporary table syncDelete (_Assoc_key int not null)''', None)
+                mappinglib.bcpCopy('syncDelete', deleteFile, bcpdelim, 'pg_temp')
+                db.sql('''delete from MLD_Expt_Marker m
+                    using syncDelete d
+                    where m._Assoc_key = d._Assoc_key''', None)
 
 def createExperimentBCP(chromosome):
         '''
@@ -592,79 +1233,166 @@ def createExperimentBCP(chromosome):
         #
         '''
 
-        global exptKey, accKey, mgiKey, exptTag
+        global exptTag
         global exptDict, seqExptDict, exptCount
 
-        bcpWrite(exptFile, [exptKey, referenceKey, exptType, exptTag, chromosome, loaddate, loaddate])
-        bcpWrite(accFile, [accKey, \
-                        mgiPrefix + str(mgiKey), \
-                        mgiPrefix, \
-                        mgiKey, \
-                        logicalDBKey, \
-                        exptKey, \
-                        mgiTypeKey, \
-                        0, 1, \
-                        createdByKey, createdByKey, loaddate, loaddate])
+        exptKey = reserveExptKey()
+
+        exptWriter.write(exptKey, referenceKey, exptTag, chromosome)
+        accessions.append(exptKey)
 
         exptDict[chromosome] = exptKey
         seqExptDict[exptKey] = 1
-        exptKey = exptKey + 1
         exptTag = exptTag + 1
-        accKey = accKey + 1
-        mgiKey = mgiKey + 1
         exptCount = exptCount + 1
 
-def processFile():
+def createAccessionBCP():
         '''
         # requires:
         #
         # effects:
-        #	Reads input file
-        #	Verifies and Processes each line in the input file
+        #	creates the ACC_Accession bcp entries of the new experiments,
+        #	once all of them are known:
+        #	the Accession keys are reserved from acc_accession_seq and the
+        #	MGI numbers are claimed in ACC_AccessionMax, each in one block
+        #	(not claimed in preview mode)
+        #	the claim is committed at once, on its own connection, so
+        #	that ACC_AccessionMax is not locked during the load; the
+        #	numbers of a failed load are not given back
         #
         # returns:
         #	nothing
         #
         '''
 
-        global referenceKey
-        global exptDict, seqExptDict
-        global lineNum
+        global accessionKeys, mgiFirst
 
-        lineNum = 0
-        note = ''
+        accKeys = mappinglib.reserveKeys('acc_accession_seq', len(accessions), claim = not DEBUG)
+        accessionKeys = list(zip(accessions, accKeys))
+        if DEBUG or len(accessions) == 0:
+                mgiFirst = mappinglib.claimAccessionMax(mgiPrefix, len(accessions), claim = 0)
+        else:
+                connection = mappinglib.connect(db.get_sqlServer(), db.get_sqlDatabase(), db.get_sqlUser(), password)
+                mgiFirst = mappinglib.claimAccessionMax(mgiPrefix, len(accessions), connection = connection)
+                connection.close()
+
+        writeAccessions()
+
+def writeAccessions():
+        '''
+        # requires:
+        #
+        # effects:
+        #	writes the ACC_Accession bcp entries of accessionKeys,
+        #	numbered from mgiFirst
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        mgiKey = mgiFirst
+
+        for exptKey, accKey in accessionKeys:
+                accWriter.write(accKey, mgiPrefix + str(mgiKey), mgiKey, exptKey)
+                mgiKey = mgiKey + 1
 
-        # For each line in the input file
+def readInput(fp, lineNum = 0):
+        '''
+        # requires:
+        #	fp - file pointer of the input file (or list of its lines)
+        #	lineNum - number of the input lines before fp (default 0)
+        #
+        # effects:
+        #	streams the input file, parsing each line exactly once
+        #
+        # returns:
+        #	generator of (lineNum, tokens, line) for each line
+        #	tokens is a tuple of the 9 mapping fields, or None if the
+        #	line is not a mapping record (the note)
+        #
+        '''
 
-        inputFile = open(inputFileName, 'r')
-        for line in inputFile.readlines():
+        start = lineNum
 
-                error = 0
+        for line in fp:
                 lineNum = lineNum + 1
 
                 # Split the line into tokens
-                tokens = str.split(line[:-1], '|')
+                tokens = str.split(str.rstrip(line, '\n'), '|')
 
-                try:
-                        mappingKey = tokens[0]
-                        markerID = tokens[1]
-                        chromosome = tokens[2]
-                        updateChr = tokens[3]
-                        band = tokens[4]
-                        assay = tokens[5]
-                        description = tokens[6]
-                        jnum = tokens[7]
-                        createdBy = tokens[8]
-                except:
-                        # if it's not a valid line, assume it's the note
-                        note = line
+                # if it's not a valid line, assume it's the note
+                if len(tokens) < 9:
+                        yield lineNum, None, line
+                else:
+                        yield lineNum, tuple(tokens[:9]), line
+
+        mappinglib.addCounter('linesRead', lineNum - start)
+
+def resolveInput(records):
+        '''
+        # requires:
+        #	records - generator of (lineNum, tokens, line) (see readInput)
+        #
+        # effects:
+        #	holds back up to mappinglib.markerBatchSize records at a time
+        #	and resolves their new marker ids in one batch (loadRecordMarkers)
+        #	before passing them on, so that markerDict is filled before
+        #	the records are verified
+        #
+        # returns:
+        #	generator of (lineNum, tokens, line)
+        #
+        '''
+
+        batch = []
+
+        for record in records:
+                batch.append(record)
+                if len(batch) >= mappinglib.markerBatchSize:
+                        loadRecordMarkers(batch)
+                        yield from batch
+                        batch = []
+
+        loadRecordMarkers(batch)
+        yield from batch
+
+def validateInput(records):
+        '''
+        # requires:
+        #	records - generator of (lineNum, tokens, line) (see resolveInput)
+        #
+        # effects:
+        #	verifies each mapping record
+        #	writes to the error file if the record is invalid
+        #
+        # returns:
+        #	generator of (lineNum, tokens, markerKey, assayKey, referenceKey)
+        #	for each valid mapping record
+        #	the note (if any) is passed on last, as
+        #	(lineNum, None, note, 0, referenceKey of the last record)
+        #
+        '''
+
+        note = ''
+        noteLineNum = 0
+        referenceKey = 0
+        valid = 0
+        invalid = 0
+
+        for lineNum, tokens, line in records:
+
+                if tokens is None:
+                        note = str.rstrip(line, '\n')
+                        noteLineNum = lineNum
                         continue
-#			exit(1, 'Invalid Line (%d): %s\n' % (lineNum, line))
+
+                mappingKey, markerID, chromosome, updateChr, band, assay, description, jnum, createdBy = tokens
 
                 markerKey, markerSymbol = verifyMarker(markerID, lineNum)
                 assayKey = verifyAssay(assay)
-                referenceKey = loadlib.verifyReference(jnum, 0, errorFile)
-                createdByKey = loadlib.verifyUser(createdBy, 0, errorFile)
+                referenceKey = verifyReference(jnum, lineNum)
+                createdByKey = verifyUser(createdBy, lineNum)
                 error = not verifyChromosome(chromosome, lineNum)
 
                 if markerKey == 0 or \
@@ -676,13 +1404,422 @@ def processFile():
 
                 # if errors, continue to next record
                 if error:
+                        invalid = invalid + 1
+                        checkErrorBudget(1)
+                        continue
+
+                valid = valid + 1
+                yield lineNum, tokens, markerKey, assayKey, referenceKey
+
+        mappinglib.addCounter('recordsValid', valid)
+        mappinglib.addCounter('recordsInvalid', invalid)
+
+        if len(note) > 0:
+                yield noteLineNum, None, note, 0, referenceKey
+
+def initWorker(assays, chromosomes):
+        '''
+        # requires:
+        #	assays - assayDict of the main process
+        #	chromosomes - chromosomeList of the main process
+        #
+        # effects:
+        #	initializes a validateParallel worker process
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        global assayDict, chromosomeList, errorBudget
+
+        # the main process keeps the error budget
+        errorBudget = 0
+
+        assayDict = assays
+        chromosomeList = chromosomes
+
+def chunkRecords(lineNum, lines, parsed):
+        '''
+        # requires:
+        #	lineNum - number of the input lines before the chunk
+        #	lines - list of raw input lines, or of (lineNum, tokens, line)
+        #	parsed - true if lines are (lineNum, tokens, line) records
+        #
+        # returns:
+        #	the records of the chunk (see readInput): the raw lines are
+        #	parsed, the records are taken as they are
+        #
+        '''
+
+        if parsed:
+                return lines
+
+        return readInput(lines, lineNum)
+
+def scanChunk(lineNum, lines, parsed, hashing):
+        '''
+        # requires:
+        #	lineNum - number of the input lines before the chunk
+        #	lines, parsed - see chunkRecords
+        #	hashing - see recordMarkers
+        #
+        # effects:
+        #	runs in a worker process (see validateParallel)
+        #	parses the lines and collects what the main process
+        #	resolves against the database before the lines are
+        #	verified (see validateChunk).  stops at the first record
+        #	with an unknown Assay, which stops the load
+        #
+        # returns:
+        #	dictionary of:
+        #	records - number of mapping records
+        #	markerIDs, hashes - see recordMarkers
+        #	jnums, users - the J:s and users, once each, in input order
+        #	lastJnum - the J: of the last record (None if no records)
+        #	note - (lineNum, note) of the last line that is not a
+        #		mapping record (None if no such line)
+        #	badAssay - (lineNum, markerID, assay) of the record with an
+        #		unknown Assay (None if there is none)
+        #
+        '''
+
+        scan = {'records' : 0, 'jnums' : [], 'users' : [], 'lastJnum' : None, 'note' : None, 'badAssay' : None}
+        records = []
+        jnums = set()
+        users = set()
+
+        for record in chunkRecords(lineNum, lines, parsed):
+                lineNum, tokens, line = record
+
+                if tokens is None:
+                        scan['note'] = (lineNum, str.rstrip(line, '\n'))
+                        continue
+
+                records.append(record)
+
+                if tokens[5] not in assayDict:
+                        scan['badAssay'] = (lineNum, tokens[1], tokens[5])
+                        break
+
+                if tokens[7] not in jnums:
+                        jnums.add(tokens[7])
+                        scan['jnums'].append(tokens[7])
+                if tokens[8] not in users:
+                        users.add(tokens[8])
+                        scan['users'].append(tokens[8])
+                scan['lastJnum'] = tokens[7]
+
+        scan['records'] = len(records)
+        scan['markerIDs'], scan['hashes'] = recordMarkers(records, hashing)
+
+        return scan
+
+def validateChunk(lineNum, lines, parsed, markers, references, users):
+        '''
+        # requires:
+        #	lineNum - number of the input lines before the chunk
+        #	lines, parsed - see chunkRecords
+        #	markers - markerDict entries of the marker ids in lines
+        #	references - referenceCache entries of the J:s in lines
+        #	users - userCache entries of the users in lines
+        #
+        # effects:
+        #	runs in a worker process (see validateParallel)
+        #	parses and verifies the lines with readInput (see
+        #	chunkRecords) and validateInput, against the lookups
+        #	resolved by the main process
+        #
+        # returns:
+        #	list of (lineNum, tokens, markerKey, assayKey, referenceKey)
+        #	for each valid record (see validateInput; without the note),
+        #	the errors (see mappinglib.ErrorCollector.replay) and the
+        #	cache hits
+        #
+        '''
+
+        global errorCollector, markerDict, referenceCache, userCache, cacheHits
+
+        errorCollector = mappinglib.ErrorCollector(keepEvents = 1)
+        markerDict = markers
+        referenceCache = references
+        userCache = users
+        cacheHits = {}
+
+        results = []
+        for record in validateInput(chunkRecords(lineNum, lines, parsed)):
+                if record[1] is not None:
+                        results.append(record)
+
+        return results, errorCollector.events, cacheHits
+
+def validateParallel(lines, parsed = 0):
+        '''
+        # requires:
+        #	lines - iterable of the raw input lines or, if parsed,
+        #		of (lineNum, tokens, line) records (inputRecords,
+        #		whose tokens are passed on as they are: a field may
+        #		hold the delimiter)
+        #
+        # effects:
+        #	same as validateInput(resolveInput(readInput(lines))), but
+        #	the lines are parsed and verified validateChunkSize lines at
+        #	a time by validateWorkers worker processes, in two passes:
+        #
+        #	scanChunk - a worker parses the chunk and sends back its
+        #		distinct marker ids, J:s and users
+        #	the main process resolves them against the database, in
+        #	batches (all database lookups stay here)
+        #	validateChunk - a worker verifies the chunk against those
+        #		lookups and sends back the valid records
+        #
+        #	the main process only passes the lines on and takes the
+        #	results and the error text of the chunks back, in input
+        #	order, so the output is the same as that of a serial run
+        #
+        # returns:
+        #	generator of (lineNum, tokens, markerKey, assayKey, referenceKey)
+        #	(see validateInput)
+        #
+        '''
+
+        note = None
+        jnum = None
+        badAssay = None
+        valid = 0
+        invalid = 0
+        lineCount = 0
+        scanning = []
+        validating = []
+
+        def chunks():
+                chunk = []
+                for line in lines:
+                        chunk.append(line)
+                        if len(chunk) >= validateChunkSize:
+                                yield chunk
+                                chunk = []
+                if len(chunk) > 0:
+                        yield chunk
+
+        def resolve(task):
+                nonlocal note, jnum, badAssay, invalid
+
+                lineNum, chunk, result = task
+                scan = result.get()
+
+                if scan['note'] is not None:
+                        note = scan['note']
+                if scan['lastJnum'] is not None:
+                        jnum = scan['lastJnum']
+                records = scan['records']
+                if scan['badAssay'] is not None:
+                        badAssay = scan['badAssay']
+                        chunk = chunk[:badAssay[0] - lineNum - 1]
+                        records = records - 1
+
+                resolveRecordMarkers(scan['markerIDs'], scan['hashes'])
+                markers = {}
+                for markerID in scan['markerIDs']:
+                        if markerID in markerDict:
+                                markers[markerID] = markerDict[markerID]
+
+                # resolve the new J:s and users in input order,
+                # and count the lookups the workers will see as
+                # hits that a serial run counts as misses
+
+                misses = dict(cacheMisses)
+                for value in scan['jnums']:
+                        if value not in referenceCache:
+                                fillCache('Reference', referenceCache, loadlib.verifyReference, value, 0)
+                for value in scan['users']:
+                        if value not in userCache:
+                                fillCache('User', userCache, loadlib.verifyUser, value, 0)
+                for cacheName in cacheMisses:
+                        cacheHits[cacheName] = cacheHits.get(cacheName, 0) - \
+                                (cacheMisses[cacheName] - misses.get(cacheName, 0))
+
+                references = dict([(value, referenceCache[value]) for value in scan['jnums']])
+                users = dict([(value, userCache[value]) for value in scan['users']])
+
+                invalid = invalid + records
+                validating.append((records, pool.apply_async(validateChunk, (lineNum, chunk, parsed, markers, references, users))))
+
+        def results(task):
+                records, result = task
+                chunkResults, errors, hits = result.get()
+                for cacheName in hits:
+                        cacheHits[cacheName] = cacheHits.get(cacheName, 0) + hits[cacheName]
+                errorCollector.replay(errors)
+                checkErrorBudget(records - len(chunkResults))
+                return chunkResults
+
+        # a forked worker must not write out what is still buffered
+        diagFile.flush()
+        errorFile.flush()
+        if errorDetailFile is not None:
+                errorDetailFile.flush()
+
+        pool = multiprocessing.Pool(validateWorkers, initWorker, (assayDict, chromosomeList))
+
+        try:
+                for chunk in chunks():
+                        scanning.append((lineCount, chunk, pool.apply_async(scanChunk, (lineCount, chunk, parsed, previewCache is not None))))
+                        lineCount = lineCount + len(chunk)
+
+                        while len(scanning) > validateWorkers and badAssay is None:
+                                resolve(scanning.pop(0))
+
+                        while len(validating) > 2 * validateWorkers:
+                                for result in results(validating.pop(0)):
+                                        valid = valid + 1
+                                        yield result
+
+                        if badAssay is not None:
+                                break
+
+                while len(scanning) > 0 and badAssay is None:
+                        resolve(scanning.pop(0))
+
+                while len(validating) > 0:
+                        for result in results(validating.pop(0)):
+                                valid = valid + 1
+                                yield result
+        finally:
+                pool.terminate()
+
+        mappinglib.addCounter('linesRead', lineCount)
+
+        # the record with the unknown Assay stops the load (verifyAssay)
+        if badAssay is not None:
+                lineNum, markerID, assay = badAssay
+                verifyMarker(markerID, lineNum)
+                verifyAssay(assay)
+
+        mappinglib.addCounter('recordsValid', valid)
+        mappinglib.addCounter('recordsInvalid', invalid - valid)
+
+        if note is not None and len(note[1]) > 0:
+                referenceKey = 0
+                if jnum is not None:
+                        referenceKey = referenceCache[jnum][0]
+                yield note[0], None, note[1], 0, referenceKey
+
+def checkErrorBudget(invalid):
+        '''
+        # requires:
+        #	invalid - number of new invalid records
+        #
+        # effects:
+        #	stops the load once more than errorBudget records are invalid
+        #	(nothing is loaded; the error file has the errors so far)
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        global invalidRecords
+
+        invalidRecords = invalidRecords + invalid
+
+        if errorBudget > 0 and invalidRecords > errorBudget:
+                exit(1, 'Error budget exceeded: more than %d invalid records\n' % (errorBudget))
+
+def selectReference(key):
+        '''
+        # requires:
+        #	key - Reference key of the record being processed
+        #
+        # effects:
+        #	makes the experiments of the Reference current:
+        #	saves exptDict/seqExptDict/exptTag of the current Reference
+        #	and restores those of the Reference, or, the first time the
+        #	Reference is seen, starts them with createExperimentMaster
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        global referenceKey
+        global exptDict, seqExptDict, exptTag
+
+        if key == referenceKey and key in referenceState:
+                return
+
+        if referenceKey in referenceState:
+                referenceState[referenceKey] = [exptDict, seqExptDict, exptTag]
+
+        referenceKey = key
+
+        if key in referenceState:
+                exptDict, seqExptDict, exptTag = referenceState[key]
+        else:
+                exptDict = {}
+                seqExptDict = {}
+                exptTag = 1
+                createExperimentMaster()
+                referenceState[key] = [exptDict, seqExptDict, exptTag]
+
+def processRecords(records, parsed = 1):
+        '''
+        # requires:
+        #	records - generator of (lineNum, tokens, line) (see readInput)
+        #		or, if not parsed, iterable of the raw input lines
+        #		(validateWorkers > 1: the workers parse them, see
+        #		validateParallel)
+        #
+        # effects:
+        #	Streams the records through the pipeline:
+        #		resolveInput -> validateInput
+        #	(or validateParallel if validateWorkers > 1)
+        #	Assigns experiment keys and writes the bcp files for each
+        #	valid record
+        #	Experiments are created as each new chromosome is found
+        #
+        #	pipelined (MAPPINGPIPELINE = yes): the records are read and
+        #	parsed in a reader thread (mappinglib.readerStage), and the
+        #	bcp rows are formatted and written in a writer thread
+        #	(mappinglib.WriterStage), connected by bounded queues, so
+        #	that both overlap with the lookups.  the validation, keys
+        #	and sequence numbers stay in this thread, in input order,
+        #	along with every database call (db.py connection), so the
+        #	output is the same as that of a serial run
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        global maxMappingKey
+
+        if validateWorkers <= 1 and not parsed:
+                records = readInput(records)
+
+        if pipeline:
+                records = mappinglib.readerStage(records, pipelineQueueSize)
+                stage = mappinglib.WriterStage([exptWriter, exptMarkerWriter, noteWriter], pipelineQueueSize)
+
+        if validateWorkers > 1:
+                records = validateParallel(records, parsed)
+        else:
+                records = validateInput(resolveInput(records))
+
+        for lineNum, tokens, markerKey, assayKey, recordReferenceKey in records:
+
+                # the note is passed on in place of the marker key
+                if tokens is None:
+                        noteWriter.write(recordReferenceKey, markerKey)
                         continue
 
-                # if no errors, process
+                mappingKey, markerID, chromosome, updateChr, band, assay, description, jnum, createdBy = tokens
+
+                if str.isdigit(mappingKey):
+                        maxMappingKey = max(maxMappingKey, int(mappingKey))
 
-                # run once...needs the reference
-                if lineNum == 1:
-                        createExperimentMaster()
+                # run once per reference...
+                selectReference(recordReferenceKey)
 
                 # determine experiment key for this chromosome
                 # if it doesn't exist, create it
@@ -691,7 +1828,8 @@ def processFile():
                         createExperimentBCP(chromosome)
 
                 if chromosome not in exptDict:
-                        errorFile.write('Cannot Find Experiment Key For Chromosome (%d): %s\n' % (lineNum, chromosome))
+                        errorCollector.add('Cannot Find Experiment Key For Chromosome', chromosome, lineNum, \
+                                'Cannot Find Experiment Key For Chromosome (%d): %s\n' % (lineNum, chromosome))
                         chrExptKey = 0
                 else:
                         chrExptKey = exptDict[chromosome]
@@ -701,127 +1839,440 @@ def processFile():
                         continue
 
                 # add marker to experiment marker file
-                bcpWrite(exptMarkerFile, \
-                        [mappingKey, \
-                        chrExptKey, \
-                        markerKey, \
-                        alleleKey, \
-                        assayKey, \
-                        seqExptDict[chrExptKey], \
-                        description, \
-                        matrixData, \
-                        loaddate, loaddate])
+                # (sync: only if it is not there yet)
+                if syncMode:
+                        syncRecord(mappingKey, chrExptKey, markerKey, assayKey, description)
+                else:
+                        exptMarkerWriter.write(mappingKey, chrExptKey, markerKey, assayKey, \
+                                seqExptDict[chrExptKey], description)
 
                 # increment marker sequence number for the experiment
                 seqExptDict[chrExptKey] = seqExptDict[chrExptKey] + 1
 
-#	end of "for line in inputFile.readlines():"
+        if pipeline:
+                stage.close()
 
-        if len(note) > 0:
-                bcpWrite(noteFile, [referenceKey, note, loaddate, loaddate])
+def processFile():
+        '''
+        # requires:
+        #
+        # effects:
+        #	Processes each input file (or inputRecords), in order
+        #	(see processRecords)
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        global inputFile
+
+        if inputRecords is not None:
+                processRecords(inputRecords)
+
+        for fileName in inputFileNames:
+
+                # the checksum of the run manifest is taken as the file
+                # is read (stdin cannot be read again by --resume)
+                reader = None
+                try:
+                        if fileName != '-':
+                                reader = mappinglib.ChecksumReader(fileName)
+                        inputFile = mappinglib.openInput(fileName, reader)[0]
+                except:
+                        exit(1, 'Could not open file %s\n' % fileName)
+
+                # the errors are listed by file:line
+                if len(inputFileNames) > 1:
+                        diagFile.write('Processing Input File: %s\n' % (fileName))
+                        errorCollector.source = fileName
+
+                processRecords(inputFile, parsed = 0)
+                inputFile.close()
+
+                if reader is None:
+                        inputChecksums.append([fileName, None])
+                else:
+                        inputChecksums.append([fileName, reader.hexdigest()])
+
+        for cacheName in ('Reference', 'User'):
+                diagFile.write('%s cache: %d hits, %d misses\n' % \
+                        (cacheName, cacheHits.get(cacheName, 0), cacheMisses.get(cacheName, 0)))
 
-def bcpWrite(fp, values):
+def flushFiles():
         '''
+        # requires:
+        #
+        # effects:
+        #	writes out the rows still buffered by the bcp writers
+        #	and records the rows/bytes of each bcp file (metrics)
+        #
+        # returns:
+        #	nothing
         #
+        '''
+
+        for table, writer in (('MLD_Expts', exptWriter), \
+                              ('MLD_Expt_Marker', exptMarkerWriter), \
+                              ('ACC_Accession', accWriter), \
+                              ('MLD_Notes', noteWriter)):
+                writer.flush()
+                mappinglib.setCounter('%s.rows' % (table), writer.rows)
+                mappinglib.setCounter('%s.bytes' % (table), writer.bytes)
+                if writer.bytes > stagingSize:
+                        diagFile.write('%s: %d bytes staged in a temporary file\n' % (table, writer.bytes))
+
+def spillFiles():
+        '''
         # requires:
-        #	fp; file pointer of bcp file
-        #	values; list of values
         #
         # effects:
-        #	converts each value item to a str.and writes out the values
-        #	to the bcpFile using the appropriate delimiter
+        #	writes the staged bcp rows to the *.mapping.bcp files
         #
         # returns:
         #	nothing
         #
         '''
 
-        # convert all members of values to str.
-        strvalues = []
-        for v in values:
-                strvalues.append(str(v))
+        for fileName, fp in ((exptFileName, exptFile), \
+                             (exptMarkerFileName, exptMarkerFile), \
+                             (accFileName, accFile), \
+                             (noteFileName, noteFile)):
+                try:
+                        mappinglib.copyFile(fp, fileName)
+                except:
+                        exit(1, 'Could not open file %s\n' % fileName)
+
+def readChecksums():
+        '''
+        # requires:
+        #
+        # effects:
+        #	--resume: reads the input files (as stored, not decompressed)
+        #
+        # returns:
+        #	list of [input file name, sha1] (see inputChecksums);
+        #	the sha1 of stdin ('-') is None: it cannot be read again
+        #
+        '''
+
+        inputFiles = []
+
+        for fileName in inputFileNames:
+                if fileName == '-':
+                        inputFiles.append([fileName, None])
+                        continue
+                fp = open(fileName, 'rb')
+                inputFiles.append([fileName, mappinglib.fileChecksum(fp)])
+                fp.close()
 
-        fp.write('%s\n' % (str.join(bcpdelim, strvalues)))
+        return inputFiles
 
-def bcpFiles():
+def checkpoint():
         '''
         # requires:
         #
         # effects:
-        #	BCPs the data into the database
+        #	writes the run manifest (manifestFileName) before the load:
+        #	the mode, the input files and their checksums, the keys and
+        #	MGI numbers used, the experiments deleted by full mode, and
+        #	for each table its bcp file, rows, checksum and load status
+        #	(pending / loaded), and whether the changes made on the db.py
+        #	connection (full/sync deletes) are
+        #	committed; the manifest is updated as the load goes on
+        #	(see bcpFiles) and is read by resumeLoad
         #
         # returns:
         #	nothing
         #
         '''
 
-        exptFile.close()
-        exptMarkerFile.close()
-        accFile.close()
-        noteFile.close()
-        db.commit()
+        global manifest
+
+        tables = {}
+        for table, fp, writer, fileName in (('MLD_Expts', exptFile, exptWriter, exptFileName), \
+                                            ('MLD_Expt_Marker', exptMarkerFile, exptMarkerWriter, exptMarkerFileName), \
+                                            ('ACC_Accession', accFile, accWriter, accFileName), \
+                                            ('MLD_Notes', noteFile, noteWriter, noteFileName)):
+                tables[table] = {'file' : fileName, 'rows' : writer.rows, \
+                        'sha1' : mappinglib.fileChecksum(fp), 'status' : 'pending'}
+
+        manifest = {'status' : 'loading', \
+                'start' : mgi_utils.date(), \
+                'mode' : mode, \
+                'experimentType' : exptType, \
+                'inputFiles' : inputChecksums, \
+                'experimentKeys' : accessions, \
+                'accessionKeys' : accessionKeys, \
+                'mgiNumbers' : [mgiFirst, len(accessionKeys)], \
+                'maxMappingKey' : maxMappingKey, \
+                'fullDeletes' : fullDeletes, \
+                'database' : 'pending', \
+                'tables' : tables}
+
+        mappinglib.writeManifest(manifestFileName, manifest)
+
+def resumeLoad():
+        '''
+        # requires:
+        #
+        # effects:
+        #	--resume: prepares the load of the tables the run manifest
+        #	(see checkpoint) lists as pending, from the bcp files of
+        #	the failed run, instead of validating the input again.
+        #	the run must have the same mode and input files (checksums),
+        #	and the bcp files must be unchanged.
+        #	if the db.py connection changes of the failed run were rolled
+        #	back, the full mode deletes are made again; sync mode cannot
+        #	be resumed in that case.  the MGI numbers were committed when
+        #	they were claimed (see createAccessionBCP) and are kept.
+        #	the program is aborted if the load cannot be resumed.
+        #
+        # returns:
+        #	nothing
+        #
+        '''
 
-        bcpCommand = os.environ['PG_DBUTILS'] + '/bin/bcpin.csh'
-        currentDir = os.getcwd()
+        global manifest, maxMappingKey
+        global exptFile, exptMarkerFile, accFile, noteFile
 
-        cmd1 = '%s %s %s %s %s %s "%s" "\\n" mgd' % \
-           (bcpCommand, db.get_sqlServer(), db.get_sqlDatabase(), 'MLD_Expts', currentDir, exptFileName, bcpdelim)
+        if DEBUG:
+                exit(1, 'Nothing to resume in %s mode\n' % (mode))
 
-        cmd2 = '%s %s %s %s %s %s "%s" "\\n" mgd' % \
-           (bcpCommand, db.get_sqlServer(), db.get_sqlDatabase(), 'MLD_Expt_Marker', currentDir, exptMarkerFileName, bcpdelim)
+        try:
+                manifest = mappinglib.readManifest(manifestFileName)
+        except:
+                exit(1, 'Could not read run manifest %s\n' % (manifestFileName))
 
-        cmd3 = '%s %s %s %s %s %s "%s" "\\n" mgd' % \
-           (bcpCommand, db.get_sqlServer(), db.get_sqlDatabase(), 'ACC_Accession', currentDir, accFileName, bcpdelim)
+        if manifest['status'] == 'complete':
+                exit(1, 'Nothing to resume: the load of %s is complete\n' % (manifest['start']))
 
-        cmd4 = '%s %s %s %s %s %s "%s" "\\n" mgd' % \
-           (bcpCommand, db.get_sqlServer(), db.get_sqlDatabase(), 'MLD_Notes', currentDir, noteFileName, bcpdelim)
+        if manifest['mode'] != mode or manifest['experimentType'] != exptType:
+                exit(1, 'Cannot resume: the failed load was run in mode %s, Experiment Type %s\n' % \
+                        (manifest['mode'], manifest['experimentType']))
 
-        diagFile.write('%s\n' % cmd1)
-        diagFile.write('%s\n' % cmd2)
-        diagFile.write('%s\n' % cmd3)
-        diagFile.write('%s\n' % cmd4)
+        if len(inputFileNames) > 0:
+                if readChecksums() != manifest['inputFiles']:
+                        exit(1, 'Cannot resume: the input files have changed since the failed load\n')
 
-        os.system(cmd1)
-        os.system(cmd2)
-        os.system(cmd3)
-        os.system(cmd4)
+        if manifest['database'] == 'pending' and mode == 'sync':
+                exit(1, 'Cannot resume: the sync changes of the failed load were rolled back; rerun the load\n')
 
-        # update mld_expts_seq auto-sequence
-        db.sql(''' select setval('mld_expts_seq', (select max(_Expt_key) from MLD_Expts)) ''', None)
-        db.commit()
+        fps = {}
+        for table in manifest['tables']:
+                entry = manifest['tables'][table]
+                if entry['status'] != 'pending':
+                        continue
+                try:
+                        fp = open(entry['file'], 'r')
+                except:
+                        exit(1, 'Cannot resume: could not open file %s\n' % (entry['file']))
+                if mappinglib.fileChecksum(fp) != entry['sha1']:
+                        exit(1, 'Cannot resume: %s has changed since the failed load\n' % (entry['file']))
+                fps[table] = fp
 
-        # update mld_expt_marker_seq auto-sequence
-        db.sql(''' select setval('mld_expt_marker_seq', (select max(_Assoc_key) from MLD_Expt_Marker)) ''', None)
-        db.commit()
+        exptFile = fps.get('MLD_Expts', exptFile)
+        exptMarkerFile = fps.get('MLD_Expt_Marker', exptMarkerFile)
+        accFile = fps.get('ACC_Accession', accFile)
+        noteFile = fps.get('MLD_Notes', noteFile)
+
+        maxMappingKey = manifest['maxMappingKey']
+
+        diagFile.write('\nResuming the load of %s: %s\n' % (manifest['start'], \
+                ', '.join([table for table in manifest['tables'] if table in fps])))
+
+        if manifest['database'] == 'committed':
+                return
+
+        if mode == 'full' and len(manifest['fullDeletes']) > 0:
+                db.sql('''delete from MLD_Expts
+                        where _Expt_key in (%s)''' % (','.join([str(key) for key in manifest['fullDeletes']])), None)
+
+def bcpFiles():
+        '''
+        # requires:
+        #
+        # effects:
+        #	BCPs the data into the database
+        #	using "copy ... from stdin" (mappinglib.bcpCopyParallel):
+        #	tables that do not depend on each other (bcpDepends) are
+        #	loaded at the same time, on separate connections.
+        #
+        #	bulk load: if a table of bulkTables has more than
+        #	bulkThreshold rows, and at least bulkRatio times the rows
+        #	the table has (pg_class.reltuples; rebuilding the indexes of
+        #	a much larger table costs more than it saves), it is loaded
+        #	without index maintenance and with the triggers of
+        #	MAPPINGBULKTRIGGERS disabled, and analyzed
+        #	(mappinglib.bcpCopyBulk).
+        #	the tables are then loaded one after the other on the db.py
+        #	connection, which already holds locks on them.
+        #
+        #	the changes made on the db.py connection (the deletes
+        #	done by createExperimentMaster or applySync) are committed
+        #	before the loads; no load is committed if any load fails:
+        #	the bcp rows are then written to the bcp files, and the
+        #	run manifest (see checkpoint) lets --resume load the
+        #	tables that were not loaded (see resumeLoad)
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        if manifest is None:
+                if bcpSpill:
+                        spillFiles()
+                checkpoint()
 
-        if exptCount > 0:
-                # update the max accession ID value
-                db.sql('select * from ACC_setMax (%d)' % (exptCount), None)
+                # the loads run on other connections and may reuse the
+                # keys of the rows deleted on the db.py connection (full
+                # mode deletes, sync changes): its locks must be released
+                # before the loads, or the loads wait for it forever
+                db.commit()
+                manifest['database'] = 'committed'
+                mappinglib.writeManifest(manifestFileName, manifest)
+
+        # the tables not loaded yet (--resume: by the failed load)
+        loads = [(table, fp) for table, fp in (('MLD_Expts', exptFile), \
+                                               ('MLD_Expt_Marker', exptMarkerFile), \
+                                               ('ACC_Accession', accFile), \
+                                               ('MLD_Notes', noteFile)) \
+                 if manifest['tables'][table]['status'] == 'pending']
+
+        bulk = []
+        for table, fp in loads:
+                rows = manifest['tables'][table]['rows']
+                if table in bulkTables and bulkThreshold > 0 and rows > bulkThreshold:
+                        tableRows = mappinglib.tableRows(table)
+                        diagFile.write('%s: %d rows to load, about %d rows in the table\n' % (table, rows, tableRows))
+                        if rows >= bulkRatio * tableRows:
+                                bulk.append(table)
+
+        start = time.time()
+
+        if len(bulk) > 0:
+                diagFile.write('copy from stdin: %s (bulk load: %s)\n' % \
+                        (', '.join([table for table, fp in loads]), ', '.join(bulk)))
+                connections = []
+                results = mappinglib.bcpCopySerial(loads, bulk, bcpdelim, triggers = bulkTables)
+        else:
+                for chain in mappinglib.bcpSchedule(loads, bcpDepends):
+                        diagFile.write('copy from stdin: %s\n' % (', '.join([table for table, fp in chain])))
+                connections, results = mappinglib.bcpCopyParallel(loads, bcpDepends, \
+                        lambda: mappinglib.connect(db.get_sqlServer(), db.get_sqlDatabase(), db.get_sqlUser(), password), \
+                        bcpdelim)
+
+        failed = []
+        for table, fp in loads:
+                rows, seconds, message = results[table]
+                if message is None:
+                        diagFile.write('%s: %d rows loaded in %.2f seconds\n' % (table, rows, seconds))
+                else:
+                        diagFile.write('%s: load failed after %.2f seconds: %s\n' % (table, seconds, message))
+                        failed.append(table)
+        diagFile.write('bcp load: %.2f seconds\n' % (time.time() - start))
+
+        if len(failed) > 0:
+                for connection in connections:
+                        connection.rollback()
+                        connection.close()
+                # keep the bcp rows for --resume
+                if not bcpSpill and not resume:
+                        spillFiles()
+                manifest['status'] = 'failed'
+                mappinglib.writeManifest(manifestFileName, manifest)
+                exit(1, 'Could not load table(s): %s\n' % (', '.join(failed)) + \
+                        'rerun with --resume to load the tables that were not loaded\n')
+
+        # commit the loads; the manifest records each commit,
+        # so a failure in between can be resumed
+        db.commit()
+        if len(connections) == 0:
+                for table, fp in loads:
+                        manifest['tables'][table]['status'] = 'loaded'
+        mappinglib.writeManifest(manifestFileName, manifest)
+
+        for connection, chain in zip(connections, mappinglib.bcpSchedule(loads, bcpDepends)):
+                connection.commit()
+                connection.close()
+                for table, fp in chain:
+                        manifest['tables'][table]['status'] = 'loaded'
+                mappinglib.writeManifest(manifestFileName, manifest)
+
+        # mld_expts_seq and acc_accession_seq have already handed out
+        # the keys that were loaded; the MLD_Expt_Marker keys come from
+        # the input file, so move mld_expt_marker_seq past them
+        if maxMappingKey > 0:
+                mappinglib.advanceSequence('mld_expt_marker_seq', maxMappingKey)
                 db.commit()
 
-#
-# Main
-#
+        manifest['status'] = 'complete'
+        mappinglib.writeManifest(manifestFileName, manifest)
+
+def main(argv = None, records = None):
+        '''
+        # requires:
+        #	argv, records - see init()
+        #
+        # effects:
+        #	runs the load (everything but the final exit)
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        mappinglib.instrumentSql()
 
-#print 'mappingload:init()'
-init()
+        #print 'mappingload:init()'
+        with mappinglib.phase('init'):
+            init(argv, records)
 
-#print 'mappingload:verifyMode()'
-verifyMode()
+        #print 'mappingload:verifyMode()'
+        with mappinglib.phase('verifyMode'):
+            verifyMode()
 
-#print 'mappingload:loadDictionaries()'
-loadDictionaries()
+        if resume:
+            print('mappingload:resumeLoad()')
+            with mappinglib.phase('resumeLoad'):
+                resumeLoad()
+            with mappinglib.phase('bcpFiles'):
+                bcpFiles()
+            return
 
-#print 'mappinglaod:getPrimaryKeys'
-getPrimaryKeys()
+        #print 'mappingload:loadDictionaries()'
+        with mappinglib.phase('loadDictionaries'):
+            loadDictionaries()
 
-#print 'mappinglaod:processFile()'
-processFile()
+        #print 'mappinglaod:processFile()'
+        with mappinglib.phase('processFile'):
+            processFile()
 
-if DEBUG:
-    print('mappingload:debugging turned on: no data will be loaded')
-else:
-    print('mappinglaod:bcpFiles()')
-    bcpFiles()
+        #print 'mappingload:createAccessionBCP()'
+        with mappinglib.phase('createAccessionBCP'):
+            createAccessionBCP()
+
+        if syncMode:
+            with mappinglib.phase('applySync'):
+                applySync()
+
+        flushFiles()
+
+        if DEBUG:
+            print('mappingload:debugging turned on: no data will be loaded')
+            with mappinglib.phase('spillFiles'):
+                spillFiles()
+                savePreviewCache()
+        else:
+            print('mappinglaod:bcpFiles()')
+            with mappinglib.phase('bcpFiles'):
+                bcpFiles()
+
+#
+# Main
+#
 
-exit(0)
+if __name__ == '__main__':
+    main()
+    exit(0)
@@ -3,16 +3,19 @@
 #
 # Wrapper script to create & load new mapping experiments
 #
-# Usage:  mappingload.sh configFile
+# Usage:  mappingload.sh configFile [--resume]
+#
+# --resume : load the tables a failed run did not load (see mappingload.py)
 #
 
 CONFIG_FILE=$1
+shift
 . ${CONFIG_FILE}
 
 cd ${MAPPINGDATADIR}
 rm -rf ${MAPPINGLOG}
 touch ${MAPPINGLOG}
 date >> ${MAPPINGLOG}
-${PYTHON} ${MAPPINGLOAD}/mappingload.py -S${MGD_DBSERVER} -D${MGD_DBNAME} -U${MGD_DBUSER} -P${MGD_DBPASSWORDFILE} -M${MAPPINGMODE} -I${MAPPINGDATAFILE} -E"${EXPERIMENTTYPE}" >> ${MAPPINGLOG}
+${PYTHON} ${MAPPINGLOAD}/mappingload.py -S${MGD_DBSERVER} -D${MGD_DBNAME} -U${MGD_DBUSER} -P${MGD_DBPASSWORDFILE} -M${MAPPINGMODE} -I${MAPPINGDATAFILE} -E"${EXPERIMENTTYPE}" "$@" >> ${MAPPINGLOG}
 date >> ${MAPPINGLOG}
 
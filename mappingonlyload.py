@@ -15,8 +15,8 @@
 #
 # Assumes:
 #
-#	That no one else is adding Mapping or Accession IDs records to the 
-#       database.
+#	Other loads may add Mapping or Accession ID records at the same time:
+#	the Experiment Marker keys are reserved from mld_expt_marker_seq.
 #
 # Input(s):
 #
@@ -29,11 +29,16 @@
 #		field 6: Description
 #
 # Input:
-#       curator created file
+#       curator created file (MAPPINGONLYDATAFILE); gzip, bz2 or xz files
+#       are decompressed as they are read, '-' reads the file from stdin
 #
 # Output:
-#	SQL file:
-#		file of SQL commands for updating Marker chromosomes and bands
+#	Marker update file (MAPPINGONLYSQLFILE; it once held SQL):
+#		staged Marker chromosome/band updates, as "copy ... from stdin"
+#		text rows (mappinglib.BcpWriter), one row per Marker:
+#		_Marker_key|chromosome|cytogeneticOffset
+#		values are escaped (backslash, |, newline); an empty column
+#		means no change.  applied with one set-based update of MRK_Marker
 #	Diagnostics file of all input parameters and SQL commands
 #	Error file
 #
@@ -44,7 +49,7 @@
 #       2. Verify the createdBy is valid.
 #           If the verification fails, report the error and stop.
 #	3. Create the pre-processed file
-#       4.  Determine the next available  Experiment Marker Key
+#       4.  Reserve one Experiment Marker Key per input line
 #
 # History:
 #
@@ -59,6 +64,7 @@ import re
 import db
 import mgi_utils
 import loadlib
+import mappinglib
 
 # globals
 
@@ -78,18 +84,46 @@ outputFileName = ''
 logFileName = ''
 sqlFileName = ''
 
-nextMappingKey = 1000
+mappingKeys = []	# Experiment Marker keys reserved for the input lines
 
 jnum = ''
 createdBy = ''
 
 markerDict = {}
 
+# staged MRK_Marker updates: _Marker_key / [chromosome, cytogeneticOffset]
+# None = column is not updated
+markerUpdates = {}
+
 mode = os.getenv('MAPPINGMODE')
 
+# above this number of distinct marker ids in the input file, load every
+# mouse marker id in one query instead of looking up the input ids in batches
+markerScanThreshold = int(os.getenv('MAPPINGMARKERSCANTHRESHOLD', '10000'))
+
+# lookup snapshot file (optional, see mappinglib.openSnapshot)
+snapshotFileName = os.getenv('MAPPINGSNAPSHOT', '')
+
+# preview cache file (optional, see mappingload.resolveRecordMarkers);
+# used here by fused preview runs
+previewCacheFileName = os.getenv('MAPPINGPREVIEWCACHE', '')
+
+# MAPPINGFUSED = yes : pass the records straight to mappingload in this
+# process instead of writing MAPPINGDATAFILE for a second mappingload.py run;
+# MAPPINGDATAFILE is then only written if MAPPINGKEEPDATAFILE = yes
+fused = os.getenv('MAPPINGFUSED', 'no') == 'yes'
+keepDataFile = not fused or os.getenv('MAPPINGKEEPDATAFILE', 'no') == 'yes'
+
+# bytes of stdin/compressed input kept in memory for the second pass
+# over the input (see init); beyond that, a local temporary file
+stagingSize = int(os.getenv('MAPPINGSTAGINGSIZE', '67108864'))
+
+markerIDs = set()	# unique marker ids in the input file
+markers = {}		# marker id / (Marker key, symbol) for markerIDs
+
 DEBUG = 0
 
-if mode == 'preview':
+if mode in ('preview', 'syncpreview'):
     DEBUG = 1
 
 def exit(status, message = None):
@@ -121,11 +155,11 @@ def init():
         # Initializes global file descriptors/file names, keys, lookups
         #
         '''
-        global nextMappingKey, jnum, createdBy,jnum, createdBy, inputFile, outputFile
-        global logFile, sqlFileName, sqlFile, markerDict
+        global mappingKeys, jnum, createdBy,jnum, createdBy, inputFile, outputFile
+        global logFile, sqlFileName, sqlFile, markerDict, markerIDs, markers
 
-        results = db.sql(''' select nextval('mld_expt_marker_seq') as maxKey ''', 'auto')
-        nextMappingKey = results[0]['maxKey']
+        # temp tables/transactions must stay on one connection
+        db.useOneConnection(1)
 
         jnum = os.getenv('JNUM')
         createdBy = os.getenv('CREATEDBY')
@@ -139,14 +173,15 @@ def init():
         sqlFileName = os.getenv('MAPPINGONLYSQLFILE')
 
         try:
-            inputFile = open(inputFileName, 'r')
+            inputFile, plain = mappinglib.openInput(inputFileName)
         except:
             exit(1, 'Could not open file %s\n' % inputFileName)
                 
-        try:
-            outputFile = open(outputFileName, 'w')
-        except:
-            exit(1, 'Could not open file %s\n' % outputFileName)
+        if keepDataFile:
+                try:
+                    outputFile = open(outputFileName, 'w')
+                except:
+                    exit(1, 'Could not open file %s\n' % outputFileName)
 
         try:
             logFile = open(logFileName, 'a')
@@ -159,37 +194,93 @@ def init():
             exit(1, 'Could not open file %s\n' % sqlFileName)
 
 
-        results = db.sql('''select a.accid, m._Marker_key
-                from MRK_Marker m, MRK_Acc_View a 
-                where a._Object_key = m._Marker_key 
-                and m._Organism_key = 1''', 'auto')
-        for r in results:
-                markerKey = r['_Marker_key']
-                markerID = r['accid']
-                markerDict[markerID] = markerKey
+        # unique list of marker ids in the input file;
+        # stdin or compressed input cannot be read again cheaply, so it
+        # is staged (mappinglib.stagingFile) for readRecords as it is scanned
+        scanFile = inputFile
+        if not plain:
+                inputFile = mappinglib.stagingFile(stagingSize)
+
+        # a fused preview run with a preview cache hashes the lines the
+        # way mappingload does (the fields after the Experiment Marker
+        # key, see readRecords) to take the unchanged ones from the cache
+        hashes = None
+        if fused and DEBUG and previewCacheFileName != '':
+                hashes = []
+
+        lineCount = 0
+        for line in scanFile:
+                tokens = str.split(line, '\t')
+                markerIDs.add(tokens[0])
+                lineCount += 1
+                if not plain:
+                        inputFile.write(line)
+                if hashes is not None and len(tokens) >= 6:
+                        fields = tokens[:5] + [str.strip(tokens[5]), jnum, createdBy]
+                        hashes.append((mappinglib.lineHash(fields), tokens[0]))
+
+        if not plain:
+                scanFile.close()
+        inputFile.seek(0)
+
+        # one Experiment Marker key per line, in one block
+        # (preview: read without advancing mld_expt_marker_seq)
+        mappingKeys = mappinglib.reserveKeys('mld_expt_marker_seq', lineCount, claim = not DEBUG)
+
+        snapshot = None
+        if snapshotFileName != '':
+                snapshot = mappinglib.openSnapshot(snapshotFileName)
+
+        lookupIDs = markerIDs
+        if hashes is not None:
+                cache = mappinglib.openPreviewCache(previewCacheFileName, mappinglib.previewStamp(snapshot))
+                cachedIDs, markers, hits = mappinglib.cachedMarkers(cache, hashes)
+                lookupIDs = markerIDs - cachedIDs
+                print('preview cache hits: %d of %d lines' % (hits, len(hashes)))
+
+        # above markerScanThreshold ids, every marker id is loaded into
+        # a compact index (mappinglib.MarkerIndex) and looked up there
+        if snapshot is not None:
+                if len(lookupIDs) > markerScanThreshold:
+                        markers.update(mappinglib.snapshotMarkerIndex(snapshot).resolve(lookupIDs))
+                else:
+                        markers.update(mappinglib.snapshotMarkers(snapshot, lookupIDs))
+                snapshot.close()
+        elif len(lookupIDs) > markerScanThreshold:
+                markers.update(mappinglib.loadMarkerIndex().resolve(lookupIDs))
+        else:
+                markers.update(mappinglib.resolveMarkers(lookupIDs))
+
+        print('marker ids in input: %d, resolved: %d' % (len(markerIDs), len(markers)))
+
+        for markerID in markers:
+                markerDict[markerID] = markers[markerID][0]
 
         return 0
 
-def processFile():
+def readRecords():
         '''
         # requires:
         #
         # effects:
         #	Reads input file
         #	Verifies and Processes each line in the input file
-        #       Writes to intermediate output file
+        #       Writes to intermediate output file (if keepDataFile)
+        #	Stages the marker chromosome/band updates (markerUpdates)
+        #	Raises mappinglib.InputError on an invalid line (the
+        #	generator may run in a pipeline thread, see processFused)
         #
         # returns:
-        #	nothing
+        #	generator of (lineNum, tokens, line) in the mappingload
+        #	format (see mappingload.readInput)
         #
         '''
-        global nextMappingKey
 
         lineNum = 0
 
         # For each line in the input file
 
-        for line in inputFile.readlines():
+        for line in inputFile:
             #print('line: %s' % line)
 
             lineNum += 1
@@ -204,43 +295,163 @@ def processFile():
                 assay = tokens[4]
                 description = str.strip(tokens[5])
             except:
-                exit(1, 'Invalid Line (%d): %s\n' % (lineNum, line))
+                raise mappinglib.InputError('Invalid Line (%d): %s\n' % (lineNum, line))
 
-            outputFile.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextMappingKey, PIPE, markerID, PIPE, chromosome, PIPE, updateChr, PIPE, band, PIPE, assay, PIPE, description, PIPE, jnum, PIPE, createdBy, CRT))
-            nextMappingKey += 1
+            record = (str(mappingKeys[lineNum - 1]), markerID, chromosome, updateChr, band, assay, description, jnum, createdBy)
+            mappingLine = '%s%s' % (PIPE.join(record), CRT)
+            if keepDataFile:
+                outputFile.write(mappingLine)
 
-            # update marker's chromosome...
+            # stage the marker's chromosome and band updates;
+            # both changes to the same marker are merged into one row
             if markerID in markerDict:
                 markerKey = markerDict[markerID]
                 if updateChr == 'yes':
-                        sqlFile.write('''update MRK_Marker
-                                set modification_date = now(), chromosome = '%s' 
-                                where _Marker_key = %s\n;\n''' % (chromosome, markerKey))
+                        markerUpdates.setdefault(markerKey, [None, None])[0] = chromosome
 
                 # update cytogenetic band, if it is provided
                 if band != "":
-                        sqlFile.write('''update MRK_Marker 
-                                set modification_date = now(), cytogeneticOffset = '%s'
-                                where _Marker_key = %s\n;\n''' % (band, markerKey))
-        outputFile.close()
-        sqlFile.close()
+                        markerUpdates.setdefault(markerKey, [None, None])[1] = band
+
+            yield lineNum, record, mappingLine
+
+        if keepDataFile:
+            outputFile.close()
+
+def processFile():
+        '''
+        # requires:
+        #
+        # effects:
+        #	Reads input file (readRecords)
+        #       Writes to intermediate output file
+        #	Applies the marker updates
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        try:
+            for record in readRecords():
+                pass
+        except mappinglib.InputError as message:
+            exit(1, message)
+
         print ('DEBUG: %s' % DEBUG)
-        if not DEBUG:
-            cmd = 'psql -h %s -d %s -U %s -f %s -o %s.log' % (db.get_sqlServer(), db.get_sqlDatabase(), db.get_sqlUser(), sqlFileName, sqlFileName)
-            print('cmd: %s' % cmd)
-            os.system(cmd)
-            db.commit()
+        updateMarkers()
 
         return 0
 
+def processFused():
+        '''
+        # requires:
+        #
+        # effects:
+        #	runs mappingload in this process, on the same connection,
+        #	with the records of readRecords and the marker lookups of init
+        #	instead of MAPPINGDATAFILE, then applies the marker updates
+        #	after mappingload has loaded its data
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        import mappingload
+
+        argv = ['-S', os.getenv('MGD_DBSERVER'), \
+                '-D', os.getenv('MGD_DBNAME'), \
+                '-U', os.getenv('MGD_DBUSER'), \
+                '-P', passwordFileName, \
+                '-M', mode, \
+                '-E', os.getenv('EXPERIMENTTYPE')]
+
+        mappingload.loadMarkers(markerIDs, markers)
+        try:
+            mappingload.main(argv, readRecords())
+        except mappinglib.InputError as message:
+            mappingload.exit(1, message)
+
+        print ('DEBUG: %s' % DEBUG)
+        updateMarkers()
+
+        mappingload.exit(0)
+
+def updateMarkers():
+        '''
+        # requires:
+        #
+        # effects:
+        #	writes the staged marker updates (markerUpdates) to the
+        #	marker update file (MAPPINGONLYSQLFILE; bcp rows, see Output)
+        #	and, unless in preview mode, copies them into a temp table and
+        #	applies them with one set-based update of MRK_Marker,
+        #	in one transaction
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        # an empty column (None) is null: the column is not changed
+        writer = mappinglib.BcpWriter(sqlFile, ['_Marker_key', 'chromosome', 'cytogeneticOffset'], \
+                text = ('chromosome', 'cytogeneticOffset'), delimiter = PIPE)
+        for markerKey in markerUpdates:
+                chromosome, band = markerUpdates[markerKey]
+                writer.write(markerKey, chromosome or '', band or '')
+        writer.flush()
+        sqlFile.close()
+
+        print('marker updates staged: %d' % (len(markerUpdates)))
+
+        if DEBUG or len(markerUpdates) == 0:
+                return
+
+        db.sql('''create temporary table mrkUpdate (
+                _Marker_key int not null,
+                chromosome text null,
+                cytogeneticOffset text null)''', None)
+
+        fp = open(sqlFileName, 'r')
+        mappinglib.bcpCopy('mrkUpdate', fp, PIPE, 'pg_temp')
+        fp.close()
+
+        db.sql('''update MRK_Marker m
+                set modification_date = now(),
+                chromosome = coalesce(u.chromosome, m.chromosome),
+                cytogeneticOffset = coalesce(u.cytogeneticOffset, m.cytogeneticOffset)
+                from mrkUpdate u
+                where m._Marker_key = u._Marker_key''', None)
+
+        db.commit()
+
+def main():
+        '''
+        # requires:
+        #
+        # effects:
+        #	runs the load (everything but the final exit)
+        #
+        # returns:
+        #	nothing
+        #
+        '''
+
+        print('mappingonlyload:init()')
+        init()
+
+        if fused:
+            print ('mappingonlyload:processFused()')
+            processFused()
+        else:
+            print ('mappingonlyload:processFile()')
+            processFile()
+
 #
 # Main
 #
 
-print('mappingonlyload:init()')
-init()
-
-print ('mappingonlyload:processFile()')
-processFile()
-
-exit(0)
+if __name__ == '__main__':
+    main()
+    exit(0)
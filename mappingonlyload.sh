@@ -18,8 +18,11 @@ touch ${MAPPINGLOG}
 date >> ${MAPPINGONLYDATALOG}
 ${PYTHON} ${MAPPINGLOAD}/mappingonlyload.py >> ${MAPPINGONLYDATALOG}
 
-
+# MAPPINGFUSED=yes : mappingonlyload.py has already run mappingload
+if [ "${MAPPINGFUSED}" != "yes" ]
+then
 ${PYTHON} ${MAPPINGLOAD}/mappingload.py -S${MGD_DBSERVER} -D${MGD_DBNAME} -U${MGD_DBUSER} -P${MGD_DBPASSWORDFILE} -M${MAPPINGMODE} -I${MAPPINGDATAFILE} -E"${EXPERIMENTTYPE}" >> ${MAPPINGLOG}
+fi
 
 date >>  ${MAPPINGONLYDATALOG}
 